@@ -0,0 +1,105 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from benchmarks.fixtures import find_font, make_backgrounds, make_params
+from benchmarks.suite import BENCHMARKS, run_benchmark
+
+
+def compare(
+    results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float
+) -> List[str]:
+    """Benchmarks whose rate dropped by more than tolerance against a baseline run."""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name, {}).get("rate")
+        if (
+            old
+            and result["rate"] is not None
+            and result["rate"] < old * (1 - tolerance)
+        ):
+            regressions.append(
+                f"{name}: {result['rate']} {result['unit']} (baseline {old}, "
+                f"{result['rate'] / old - 1:+.0%})"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the render, effects, layout, video and caption hot paths offline."
+    )
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"Benchmarks to run, all by default: {', '.join(BENCHMARKS)}",
+    )
+    parser.add_argument("--n", type=int, default=None, help="Items per benchmark")
+    parser.add_argument("--font", type=str, default=None, help="Font file to use")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON here")
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="JSON of a previous run to compare to",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed slowdown against the baseline. Default is 0.1",
+    )
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        font_path = find_font(args.font)
+        ctx = {
+            "workdir": workdir,
+            "font_path": font_path,
+            "params": make_params(workdir, font_path),
+            "backgrounds": make_backgrounds(os.path.join(workdir, "background")),
+        }
+
+        results = {}
+        # A fresh process per benchmark, so the peak RSS is its own
+        context = multiprocessing.get_context("spawn")
+        for name in args.benchmarks or BENCHMARKS:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results.update(pool.submit(run_benchmark, name, ctx, args.n).result())
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "font": font_path,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
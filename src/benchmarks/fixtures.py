@@ -0,0 +1,113 @@
+import contextlib
+import glob
+import os
+from typing import Iterator, List, Optional, Tuple
+from unittest import mock
+
+import numpy as np
+import openai
+import yaml
+from PIL import Image
+
+from config.config_utils import CONFIG_DIR, load_config
+from processing.project_processing import project_config
+
+# Searched in order when no font is given, the project fonts come first
+FONT_PATTERNS = [
+    os.path.join(os.path.dirname(CONFIG_DIR), "fonts", "*.[tToO][tT][fF]"),
+    "/usr/share/fonts/**/DejaVuSans.ttf",
+    "/usr/share/fonts/**/*.ttf",
+    "/Library/Fonts/*.ttf",
+    "/System/Library/Fonts/*.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
+
+
+def find_font(font_path: Optional[str] = None) -> str:
+    """
+    Font used by the benchmarks.
+
+    Parameters:
+    - font_path (str, optional): Font to use, skips the search.
+
+    Returns:
+    - str: Path to a TrueType or OpenType font.
+    """
+    if font_path:
+        return font_path
+    for pattern in FONT_PATTERNS:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if matches:
+            return matches[0]
+    raise FileNotFoundError(
+        "No font found in src/fonts or the system fonts, pass one with --font"
+    )
+
+
+def make_backgrounds(
+    directory: str, n: int = 4, size: Tuple[int, int] = (1000, 1500), seed: int = 0
+) -> List[str]:
+    """
+    Write synthetic JPEG backgrounds, noisy gradients of the given size.
+
+    Parameters:
+    - directory (str): Directory to write to.
+    - n (int): Number of backgrounds.
+    - size (Tuple[int, int]): Width and height.
+    - seed (int): Seed of the noise, the same seed gives the same files.
+
+    Returns:
+    - List[str]: Paths of the backgrounds.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    width, height = size
+    gradient = np.linspace(0, 255, height, dtype=np.float32)[:, None, None]
+    paths = []
+    for idx in range(n):
+        tint = rng.uniform(0.3, 1.0, size=3).astype(np.float32)
+        noise = rng.normal(0, 20, size=(height, width, 3)).astype(np.float32)
+        pixels = np.clip(gradient * tint + noise, 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f"background_{idx}.jpg")
+        Image.fromarray(pixels).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def make_params(workdir: str, font_path: str) -> dict:
+    """
+    Config of a throwaway project, built from the new project template.
+
+    Parameters:
+    - workdir (str): Directory of the benchmark data.
+    - font_path (str): Font of the captions.
+
+    Returns:
+    - dict: Merged main and project config.
+    """
+    major_config = load_config(os.path.join(CONFIG_DIR, "config.yaml"))
+    minor_config = yaml.safe_load(project_config("benchmark"))
+    params = {**major_config, **minor_config, "project": "benchmark"}
+    params["path"]["path_to_font"] = os.path.dirname(font_path) + os.sep
+    params["font"]["font_type"] = os.path.basename(font_path)
+    params["background_dir"] = os.path.join(workdir, "background")
+    params["path"]["path_to_video"] = os.path.join(workdir, "videos")
+    return params
+
+
+def fake_captions(n: int) -> str:
+    """A completion listing n numbered captions, one per line."""
+    return "\n".join(
+        f'{idx + 1}. "Caption {idx}: wander far, travel light and keep the sunset close"'
+        for idx in range(n)
+    )
+
+
+@contextlib.contextmanager
+def fake_completion(n: int) -> Iterator[mock.MagicMock]:
+    """Replace the chat completion API with one that returns n captions offline."""
+    response = {"choices": [{"message": {"content": fake_captions(n)}}]}
+    with mock.patch.object(
+        openai.ChatCompletion, "create", return_value=response
+    ) as create:
+        yield create
@@ -0,0 +1,232 @@
+import contextlib
+import functools
+import io
+import os
+import sys
+import time
+from typing import Callable, Dict, Optional
+
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows, peak RSS is not reported
+    resource = None
+
+from benchmarks.fixtures import fake_completion
+from creation_caption import create_caption_bulk
+from creation_infographic import create_captioned_image
+from processing.image_processing import (
+    apply_effect_chain,
+    background_cache,
+    get_image_effect_dict,
+    image_effects,
+)
+from processing.text_processing import (
+    caption_effects,
+    font_registry,
+    get_coords,
+    layout_text,
+)
+from processing.video_processing import process_images_and_create_video
+
+CAPTIONS = [
+    "Travel is the only thing you buy that makes you richer",
+    "Wander often, wonder always",
+    "Collect moments, not things, and let the road teach you the rest",
+    "Adventure is worthwhile in itself",
+    "The world is a book and those who do not travel read only one page",
+]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB, None where unsupported."""
+    # VmHWM belongs to this process image, ru_maxrss also counts the parent
+    # that forked it before the exec
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def repeat(fn: Callable[[], object], n: int) -> Callable[[], int]:
+    """Call fn n times, for timed."""
+
+    def run() -> int:
+        for _ in range(n):
+            fn()
+        return n
+
+    return run
+
+
+def timed(fn: Callable[[], int], unit: str) -> dict:
+    """Run fn once, it returns how many items it processed."""
+    start = time.perf_counter()
+    items = fn()
+    seconds = time.perf_counter() - start
+    return {
+        "items": items,
+        "seconds": round(seconds, 4),
+        "rate": round(items / seconds, 2) if seconds else None,
+        "unit": unit,
+    }
+
+
+def bench_render(ctx: dict, n: int) -> dict:
+    """create_captioned_image, kept in memory, over the synthetic backgrounds."""
+    params, backgrounds = ctx["params"], ctx["backgrounds"]
+    font_path = ctx["font_path"]
+
+    def run() -> int:
+        for idx in range(n):
+            create_captioned_image(
+                caption=CAPTIONS[idx % len(CAPTIONS)],
+                font_path=font_path,
+                img_path=backgrounds[idx % len(backgrounds)],
+                save_to=None,
+                font_size=params["font"]["font_size"],
+                wrap_block=params["font"]["wrap_block"],
+                params=params,
+            )
+        return n
+
+    result = timed(run, "images/sec")
+    result["fonts"] = font_registry.stats()
+    result["background_hits"] = background_cache.hits
+    return result
+
+
+def bench_effects(ctx: dict, n: int) -> Dict[str, dict]:
+    """image_effects for every configured effect, and the fused effect chain."""
+    params = ctx["params"]
+    effect_dict = get_image_effect_dict(params)
+    with Image.open(ctx["backgrounds"][0]) as img:
+        image = img.convert("RGB")
+
+    results = {}
+    for effect in effect_dict:
+        apply = functools.partial(image_effects, image, effect, effect_dict)
+        results[f"effect_{effect}"] = timed(repeat(apply, n), "images/sec")
+    chain = functools.partial(apply_effect_chain, image, params=params)
+    results["effect_chain"] = timed(repeat(chain, n), "images/sec")
+    return results
+
+
+def bench_layout(ctx: dict, n: int) -> Dict[str, dict]:
+    """caption_effects and get_coords on their own, then the cached layout."""
+    params = ctx["params"]
+    font = font_registry.get(ctx["font_path"], params["font"]["font_size"])
+    wrap_block = params["font"]["wrap_block"]
+    align = params["font"]["text_coords"]["align"]
+    image = Image.new("RGB", (1000, 1500))
+    blocks = [caption_effects(caption, align, wrap_block) for caption in CAPTIONS]
+
+    def wrap() -> int:
+        for idx in range(n):
+            caption_effects(CAPTIONS[idx % len(CAPTIONS)], align, wrap_block)
+        return n
+
+    def coords() -> int:
+        for idx in range(n):
+            get_coords(image, wrap_block, blocks[idx % len(blocks)], font)
+        return n
+
+    def cached() -> int:
+        layout_text.cache_clear()
+        for idx in range(n):
+            layout_text(CAPTIONS[idx % len(CAPTIONS)], font, wrap_block, align)
+        return n
+
+    return {
+        "caption_effects": timed(wrap, "captions/sec"),
+        "get_coords": timed(coords, "captions/sec"),
+        "layout_text": timed(cached, "captions/sec"),
+    }
+
+
+def bench_video(ctx: dict, n: int) -> dict:
+    """process_images_and_create_video over n rendered pins."""
+    params = ctx["params"]
+    pins_dir = os.path.join(ctx["workdir"], "pins")
+    os.makedirs(pins_dir, exist_ok=True)
+    for idx in range(n):
+        create_captioned_image(
+            caption=CAPTIONS[idx % len(CAPTIONS)],
+            font_path=ctx["font_path"],
+            img_path=ctx["backgrounds"][idx % len(ctx["backgrounds"])],
+            save_to=os.path.join(pins_dir, f"pin_{idx:03d}.png"),
+            params=params,
+        )
+
+    video_params = params["video_processing"]
+    frames = video_params["frame_rate"] * video_params["video_duration"]
+
+    def run() -> int:
+        process_images_and_create_video(
+            pins_dir,
+            "benchmark.mp4",
+            params["path"]["path_to_video"],
+            video_duration=video_params["video_duration"],
+            resize=True,
+            frame_rate=video_params["frame_rate"],
+            params=params,
+        )
+        return frames
+
+    return timed(run, "frames/sec")
+
+
+def bench_caption_parsing(ctx: dict, n: int) -> dict:
+    """create_caption_bulk against a mocked completion of n captions."""
+    repeats = 20
+
+    def run() -> int:
+        with fake_completion(n), contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(repeats):
+                create_caption_bulk("benchmark prompt")
+        return n * repeats
+
+    return timed(run, "captions/sec")
+
+
+# name -> (benchmark, default size)
+BENCHMARKS = {
+    "render": (bench_render, 40),
+    "effects": (bench_effects, 40),
+    "layout": (bench_layout, 2000),
+    "video": (bench_video, 10),
+    "caption_parsing": (bench_caption_parsing, 200),
+}
+
+
+def run_benchmark(name: str, ctx: dict, n: Optional[int] = None) -> Dict[str, dict]:
+    """
+    Run one benchmark and attach the peak RSS of the process.
+
+    Meant to run in a fresh process so the peak belongs to this benchmark.
+
+    Parameters:
+    - name (str): Key of BENCHMARKS.
+    - ctx (dict): Workdir, params, font_path and backgrounds from the runner.
+    - n (int, optional): Number of items. Defaults to the benchmark default.
+
+    Returns:
+    - Dict[str, dict]: Results by benchmark name.
+    """
+    bench, default_n = BENCHMARKS[name]
+    results = bench(ctx, n or default_n)
+    if "rate" in results:
+        results = {name: results}
+    peak = peak_rss_mb()
+    for result in results.values():
+        result["peak_rss_mb"] = round(peak, 1) if peak is not None else None
+    return results
@@ -1,7 +1,39 @@
+import functools
+import os
 import yaml
+from typing import List, Optional
+
+# Config files are looked up next to this module, whatever the working directory
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 def load_config(path: str) -> dict:
     with open(path, "r") as file:
         params = yaml.safe_load(file)
     return params
+
+
+def discover_projects(config_dir: str = CONFIG_DIR) -> List[str]:
+    """Every project with a config.yaml under config_dir, in name order."""
+    return sorted(
+        name
+        for name in os.listdir(config_dir)
+        if os.path.isfile(os.path.join(config_dir, name, "config.yaml"))
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_config(project: Optional[str] = None) -> dict:
+    """
+    Merged main and project config, read once per project and then memoized.
+
+    Args:
+        project (str, optional): project to load, defaults to the one selected in config.yaml.
+
+    Returns:
+        dict: the shared config of the project, treat it as read only.
+    """
+    major_config = load_config(os.path.join(CONFIG_DIR, "config.yaml"))
+    project = project or major_config["project"]
+    minor_config = load_config(os.path.join(CONFIG_DIR, project, "config.yaml"))
+    return {**major_config, **minor_config, "project": project}
@@ -1,25 +1,25 @@
-from creation_caption import create_caption, create_caption_bulk
-from creation_infographic import create_captioned_image
-from processing.image_processing import get_random_image_path
-from config.config_utils import load_config
+from creation_caption import (
+    caption_prompt,
+    caption_settings,
+    create_caption,
+    create_caption_bulk,
+    create_caption_bulk_concurrent,
+    stream_captions,
+)
+from creation_batch import render_caption_stream, render_captioned_images
+from config.config_utils import get_config
+from processing.tracing import finish_tracing, start_tracing
+import argparse
 import numpy as np
+import os
 import time
 import yaml
 
 
 start = time.time()
 
-major_config = load_config("config.yaml")
-project = major_config["project"]
-minor_config = load_config(f"src/config/{project}/config.yaml")
-params = {**major_config, **minor_config}
-
-topic = params["topic"]
-language = params["language"]
-example = params["example"]
-caption_style = params["caption_style"]
-social_media = params["social_media"]
-sep = params["sep"]
+params = get_config()
+project = params["project"]
 
 line_text = params["line_text"]
 wrap_block = params["font"]["wrap_block"]
@@ -31,55 +31,98 @@ text_color = params["font"]["text_color"]
 font_size = params["font"]["font_size"]
 background_dir = params["background_dir"].format(project)
 
-
-avoid_prompt = params["avoid_prompt"]
-
 # Create Quotes Data
 n = params["create"]
-prompt = f"""
-Provide me a list of {n}  {line_text}  {caption_style} about {topic} in {language}. 
-They should fit the mood of a {social_media} post and contain high traffic keywords for {topic}.
-Separate each quote using a {sep} .
-{avoid_prompt}
-Try to use terms and keywords that have high SEO on {social_media}.
-Create the content only in {language}.
-Provide only the list with no additional content.
-
-Example output:
-{example}
-"""
-
-
-data = create_caption_bulk(prompt=prompt).replace("", np.nan).dropna()
-
-# Modify string
-data["caption"] = data["caption"].str.strip()  # .str.upper()
+prompt_template = caption_prompt(params)
 
-# Create an empty list to store the images
-img_list = []
 
-# Iterate over the captions using a normal for loop
-for idx, caption in enumerate(data["caption"]):
-    # Get a random image path
-    img_path = get_random_image_path(background_dir)
-
-    # Create the captioned image
-    captioned_image = create_captioned_image(
-        caption=caption,
-        font_path=font_path,
-        img_path=img_path,
-        save_to=f"src/data/{project}/pins/{project}_template_{idx}.png",
-        text_color=text_color,
-        font_size=font_size,
-        wrap_block=wrap_block,
+# Guarded so the render pool workers can re-import this module
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create captioned images.")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ask OpenAI again instead of reusing cached captions",
     )
-
-    # Append the captioned image to the img_list
-    img_list.append(captioned_image)
-
-data["images"] = img_list
-
-end = time.time()
-print(f"Execution in {end-start} seconds")
-# Save data
-data.to_csv(f"src/data/{project}/tables/quotes.csv", sep=",", index=False)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render every pin again, starting a new manifest",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Time each stage and write a Chrome trace to tracing.path",
+    )
+    args = parser.parse_args()
+    trace_path = start_tracing(params, force=args.trace)
+
+    caption_params = caption_settings(params, refresh=args.refresh)
+
+    render_params = params.get("render", {})
+    save_pattern = f"src/data/{project}/pins/{project}_template_{{idx}}.png"
+    quotes_path = f"src/data/{project}/tables/quotes.csv"
+    # Pins already rendered with the same inputs are skipped on a re-run
+    manifest = render_params.get("manifest")
+    manifest = manifest.format(project) if manifest else None
+    if args.force and manifest and os.path.exists(manifest):
+        os.remove(manifest)
+
+    if render_params.get("stream"):
+        # Render each pin as soon as its caption line arrives
+        captions = stream_captions(
+            prompt_template.replace("{n}", str(n)),
+            api_base=caption_params.get("api_base"),
+            cache=caption_params.get("cache"),
+            refresh=caption_params["refresh"],
+        )
+        rendered = render_caption_stream(
+            captions,
+            font_path=font_path,
+            background_dir=background_dir,
+            save_pattern=save_pattern,
+            csv_path=quotes_path,
+            text_color=text_color,
+            font_size=font_size,
+            wrap_block=wrap_block,
+            workers=render_params.get("workers"),
+            max_pending=render_params.get("max_pending"),
+            seed=render_params.get("seed"),
+            project=project,
+            manifest=manifest,
+        )
+        end = time.time()
+        print(f"Streamed {rendered} pins in {end-start} seconds")
+    else:
+        data = (
+            create_caption_bulk_concurrent(prompt_template, n, **caption_params)
+            .replace("", np.nan)
+            .dropna()
+        )
+
+        # Modify string
+        data["caption"] = data["caption"].str.strip()  # .str.upper()
+        # Keep the captions even if rendering is interrupted
+        data.to_csv(quotes_path, sep=",", index=False)
+
+        data = render_captioned_images(
+            data,
+            font_path=font_path,
+            background_dir=background_dir,
+            save_pattern=save_pattern,
+            text_color=text_color,
+            font_size=font_size,
+            wrap_block=wrap_block,
+            workers=render_params.get("workers"),
+            chunksize=render_params.get("chunksize", 4),
+            seed=render_params.get("seed"),
+            project=project,
+            manifest=manifest,
+        )
+
+        end = time.time()
+        print(f"Execution in {end-start} seconds")
+        # Save data
+        data.to_csv(quotes_path, sep=",", index=False)
+
+    finish_tracing(trace_path)
@@ -1,21 +1,16 @@
 from creation_caption import create_caption, create_caption_bulk
-from creation_infographic import create_captioned_image
-from processing.image_processing import get_random_image_path
-from processing.video_processing import (
-    process_images_and_create_video,
-)
+from creation_video import plan_video_jobs, render_videos
 import numpy as np
 import time
 import yaml
-from config.config_utils import load_config
+from config.config_utils import get_config
+from processing.tracing import finish_tracing, start_tracing
 
 start = time.time()
 
 
-major_config = load_config("src/config/config.yaml")
-project = major_config["project"]
-minor_config = load_config(f"src/config/{project}/config.yaml")
-params = {**major_config, **minor_config}
+params = get_config()
+project = params["project"]
 
 # Assign parameters to variables
 project = params["project"]
@@ -59,45 +54,46 @@ THIS IS WHY I WORK HARD.
 
 # video
 path_to_video = params["path"]["path_to_video"].format(project)
-path_to_images = f"src/data/{project}/pins"
 video_duration = params["video_processing"]["video_duration"]
 frame_rate = params["video_processing"]["frame_rate"]
 
-start = time.time()
 # Suggested 1920x1080
 n_videos = 2
 video_caption = ""  # create_caption(prompt)
-for v in range(n_videos):
-    # Create an empty list to store the images
-    img_list = []
+
+
+# Guarded so the render pool workers can re-import this module
+if __name__ == "__main__":
+    start = time.time()
+    trace_path = start_tracing(params)
 
     images_in_video = params["video_processing"]["images_in_video"]
-    # Iterate over the captions using a normal for loop
-    for idx in range(images_in_video):
-        # Get a random image path
-        img_path = get_random_image_path(background_dir)
-
-        # Create the captioned image
-        captioned_image = create_captioned_image(
-            caption=video_caption,
-            font_path=font_path,
-            img_path=img_path,
-            save_to=f"src/data/{project}/pins/{project}_template_{idx}.png",
-            text_color=text_color,
-            font_size=font_size,
-            wrap_block=wrap_block,
-        )
-
-        # Append the captioned image to the img_list
-        img_list.append(captioned_image)
-
-    process_images_and_create_video(
-        path_to_images,
-        f"output_video_{v}.mp4",
-        path_to_video,
-        video_duration=video_duration,
-        resize=True,
-        frame_rate=frame_rate,
+    # Pins stream from the renderer to each video's encoder in memory
+    keep_pins = params["video_processing"].get("keep_pins", False)
+    jobs = plan_video_jobs(
+        n_videos,
+        captions=[video_caption] * images_in_video,
+        background_dir=background_dir,
+        output_dir=path_to_video,
+        render_kwargs={
+            "font_path": font_path,
+            "text_color": text_color,
+            "font_size": font_size,
+            "wrap_block": wrap_block,
+            "params": params,
+        },
+        video_kwargs={
+            "video_duration": video_duration,
+            "resize": True,
+            "frame_rate": frame_rate,
+            "params": params,
+        },
+        pins_dir=f"src/data/{project}/pins" if keep_pins else None,
+    )
+    render_videos(
+        jobs, workers=params["video_processing"].get("workers"), project=project
     )
-end = time.time()
-print(f"Execution in {end-start} seconds")
+
+    end = time.time()
+    print(f"Execution in {end-start} seconds")
+    finish_tracing(trace_path)
@@ -0,0 +1,588 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from config.config_utils import get_config
+from creation_infographic import create_captioned_image
+from processing.background_index import pick_background
+from processing.image_processing import background_cache
+from processing.output_formats import get_image_writer, output_path
+from processing.text_processing import font_registry
+from processing.tracing import finish_tracing, start_tracing
+
+
+def init_worker(
+    font_path: str,
+    font_size: int,
+    backgrounds: Optional[dict] = None,
+    project: Optional[str] = None,
+) -> None:
+    """Warm the config, the font registry and the shared backgrounds once per worker."""
+    params = get_config(project)
+    font_registry.preload(params)
+    font_registry.get(font_path, font_size)
+    background_cache.max_bytes = (
+        params["image_processing"].get("background_cache_mb", 512) * 2**20
+    )
+    if backgrounds:
+        background_cache.attach(backgrounds)
+
+
+def project_render_kwargs(params: dict) -> dict:
+    """Keyword arguments of create_captioned_image for a project config."""
+    return {
+        "font_path": os.path.join(
+            params["path"]["path_to_font"], params["font"]["font_type"]
+        ),
+        "text_color": params["font"]["text_color"],
+        "font_size": params["font"]["font_size"],
+        "wrap_block": params["font"]["wrap_block"],
+        "params": params,
+    }
+
+
+def render_chunk(tasks: List[dict]) -> List[dict]:
+    """
+    Render a chunk of captioned images inside a worker.
+
+    Failures are caught per item so one bad caption or background does not
+    take down the rest of the batch. Each pin is encoded on the worker's
+    image writer threads while the next one is composited.
+
+    Parameters:
+    - tasks (List[dict]): Render tasks built by plan_renders.
+
+    Returns:
+    - List[dict]: One result per task with the output path or the error.
+    """
+    errors = {}
+    saves = []
+    for task in tasks:
+        try:
+            image = create_captioned_image(
+                caption=task["caption"],
+                img_path=task["background"],
+                save_to=None,
+                **task["render_kwargs"],
+            )
+            params = task["render_kwargs"].get("params")
+            saves.append(
+                (task, get_image_writer(params).submit(image, task["save_to"], params))
+            )
+        except Exception as e:
+            errors[task["idx"]] = f"{type(e).__name__}: {e}"
+    for task, save in saves:
+        try:
+            save.result()
+        except Exception as e:
+            errors[task["idx"]] = f"{type(e).__name__}: {e}"
+    return [
+        {
+            "idx": task["idx"],
+            "images": None if task["idx"] in errors else task["save_to"],
+            "error": errors.get(task["idx"]),
+        }
+        for task in tasks
+    ]
+
+
+def load_manifest(path: Optional[str]) -> Dict[str, dict]:
+    """
+    Read a render manifest, the last entry of each output path wins.
+
+    Every run appends its renders, so once superseded entries make up most
+    of the file it is rewritten with the live entries only.
+
+    Parameters:
+    - path (str, optional): The manifest, a JSON object per line.
+
+    Returns:
+    - Dict[str, dict]: Entries keyed by output path, empty if there is no manifest.
+    """
+    entries = {}
+    if not path or not os.path.exists(path):
+        return entries
+    lines = 0
+    with open(path) as file:
+        for line in file:
+            lines += 1
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line of a run that crashed mid write
+                continue
+            entries[entry["images"]] = entry
+    if lines > 2 * len(entries):
+        compact_manifest(path, entries)
+    return entries
+
+
+def compact_manifest(path: str, entries: Dict[str, dict]) -> None:
+    """Replace a manifest with one line per entry, atomically."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        for entry in entries.values():
+            file.write(json.dumps(entry) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def append_manifest(path: Optional[str], entries: List[dict]) -> None:
+    """Append finished renders to a manifest and flush them to disk."""
+    if not path or not entries:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as file:
+        for entry in entries:
+            file.write(json.dumps(entry) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def render_hash(caption: str, background: str, render_kwargs: dict) -> str:
+    """
+    Hash of everything a pin depends on.
+
+    Covers the caption, the background file and the font file (path and
+    mtime), the render arguments and the font and image_processing config
+    sections, so changing e.g. font_size invalidates every pin while a new
+    topic does not.
+    """
+    params = render_kwargs.get("params") or {}
+    font_path = render_kwargs["font_path"]
+    inputs = {
+        "caption": caption,
+        "background": [background, os.stat(background).st_mtime_ns],
+        "font": [font_path, os.stat(font_path).st_mtime_ns],
+        "render": {k: v for k, v in render_kwargs.items() if k != "params"},
+        "config": {k: params.get(k) for k in ("font", "image_processing")},
+    }
+    encoded = json.dumps(inputs, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def manifest_entry(task: dict, result: dict) -> dict:
+    """The manifest line recording the render of a task."""
+    return {
+        "idx": task["idx"],
+        "caption": task["caption"],
+        "background": task["background"],
+        "config_hash": task["config_hash"],
+        "images": task["save_to"],
+        "error": result["error"],
+    }
+
+
+def unchanged(task: dict, previous: Dict[str, dict]) -> bool:
+    """Whether the manifest holds a successful render of exactly this task."""
+    entry = previous.get(task["save_to"])
+    return (
+        entry is not None
+        and entry["error"] is None
+        and entry["config_hash"] == task["config_hash"]
+        and os.path.exists(task["save_to"])
+    )
+
+
+def _plan_task(
+    idx: int,
+    caption: str,
+    background_dir: str,
+    save_pattern: str,
+    render_kwargs: dict,
+    rng: random.Random,
+    previous: Dict[str, dict],
+) -> dict:
+    params = render_kwargs.get("params") or {}
+    save_to = output_path(save_pattern.format(idx=idx), params)
+    # Always draw, so seeded picks do not shift when a pin is reused
+    background = pick_background(
+        background_dir,
+        rng=rng,
+        size=params.get("image_processing", {}).get("pin_size"),
+        params=params,
+    )
+    entry = previous.get(save_to)
+    # Keep the recorded background unless it comes from another variant size
+    if (
+        entry is not None
+        and entry["caption"] == caption
+        and os.path.dirname(entry["background"]) == os.path.dirname(background)
+        and os.path.exists(entry["background"])
+    ):
+        background = entry["background"]
+    task = {
+        "idx": idx,
+        "caption": caption,
+        "background": background,
+        "save_to": save_to,
+        "render_kwargs": render_kwargs,
+        "config_hash": render_hash(caption, background, render_kwargs),
+    }
+    # Decided once here, the report must not look at the output after rendering
+    task["skipped"] = unchanged(task, previous)
+    return task
+
+
+def plan_renders(
+    data: pd.DataFrame,
+    background_dir: str,
+    save_pattern: str,
+    render_kwargs: dict,
+    seed: Optional[int] = None,
+    previous: Optional[Dict[str, dict]] = None,
+) -> List[dict]:
+    """
+    Build the list of render tasks for a captions DataFrame.
+
+    Backgrounds are drawn up front in the parent process so the output does
+    not depend on how tasks are spread over the workers. A pin already in the
+    manifest with the same caption keeps its background, so a re-run only
+    renders what changed: tasks with "skipped" set are already rendered.
+
+    Parameters:
+    - data (pd.DataFrame): DataFrame with a "caption" column.
+    - background_dir (str): Directory to pick backgrounds from.
+    - save_pattern (str): Output path with an "{idx}" placeholder.
+    - render_kwargs (dict): Extra keyword arguments for create_captioned_image.
+    - seed (int, optional): Seed for the background picks.
+    - previous (Dict[str, dict], optional): Manifest entries of earlier runs.
+
+    Returns:
+    - List[dict]: Render tasks in caption order.
+    """
+    rng = random.Random(seed)
+    return [
+        _plan_task(
+            idx,
+            caption,
+            background_dir,
+            save_pattern,
+            render_kwargs,
+            rng,
+            previous or {},
+        )
+        for idx, caption in enumerate(data["caption"])
+    ]
+
+
+def render_report(
+    data: pd.DataFrame,
+    tasks: List[dict],
+    results: Dict[int, dict],
+) -> pd.DataFrame:
+    """
+    Join the render results back onto the captions and print the failures.
+
+    Parameters:
+    - data (pd.DataFrame): The captions the tasks were planned from.
+    - tasks (List[dict]): Render tasks built by plan_renders.
+    - results (Dict[int, dict]): Result of every task, by task idx.
+
+    Returns:
+    - pd.DataFrame: The input rows, in order, with "background", "images", "error" and "skipped" columns.
+    """
+    data = data.reset_index(drop=True).copy()
+    data["background"] = [task["background"] for task in tasks]
+    data["images"] = [results[task["idx"]]["images"] for task in tasks]
+    data["error"] = [results[task["idx"]]["error"] for task in tasks]
+    data["skipped"] = [task["skipped"] for task in tasks]
+
+    failed = data[data["error"].notna()]
+    for idx, row in failed.iterrows():
+        print(f"Failed to render caption {idx}: {row['error']}")
+    return data
+
+
+def render_captioned_images(
+    data: pd.DataFrame,
+    font_path: str,
+    background_dir: str,
+    save_pattern: str,
+    text_color: str = "#0000",
+    font_size: int = 30,
+    wrap_block: int = 40,
+    workers: Optional[int] = None,
+    chunksize: int = 4,
+    seed: Optional[int] = None,
+    project: Optional[str] = None,
+    manifest: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Render one captioned image per caption over a process pool.
+
+    With a manifest, every finished pin is recorded with its caption,
+    background, config hash and output path as soon as its chunk completes.
+    Pins whose inputs are unchanged since a previous run are skipped, so a
+    crashed run resumes where it stopped and a config change only re-renders
+    the pins it affects.
+
+    Parameters:
+    - data (pd.DataFrame): DataFrame with a "caption" column.
+    - font_path (str): The path to the font file.
+    - background_dir (str): Directory to pick backgrounds from.
+    - save_pattern (str): Output path with an "{idx}" placeholder.
+    - text_color (str): The color of the text. Default is "#0000".
+    - font_size (int): The size of the font. Default is 30.
+    - wrap_block (int): The maximum width of the text block. Default is 40.
+    - workers (int, optional): Number of worker processes. Defaults to the CPU count, 1 renders in-process.
+    - chunksize (int): Number of images sent to a worker at a time. Default is 4.
+    - seed (int, optional): Seed for the background picks.
+    - project (str, optional): Project whose config drives the effects and layout. Defaults to the selected project.
+    - manifest (str, optional): JSON lines file recording each render, enables skipping unchanged pins.
+
+    Returns:
+    - pd.DataFrame: The input rows, in order, with "background", "images", "error" and "skipped" columns.
+    """
+    render_kwargs = {
+        "font_path": font_path,
+        "text_color": text_color,
+        "font_size": font_size,
+        "wrap_block": wrap_block,
+        "params": get_config(project),
+    }
+    previous = load_manifest(manifest)
+    tasks = plan_renders(
+        data, background_dir, save_pattern, render_kwargs, seed=seed, previous=previous
+    )
+    results = {
+        task["idx"]: {"idx": task["idx"], "images": task["save_to"], "error": None}
+        for task in tasks
+        if task["skipped"]
+    }
+    todo = [task for task in tasks if task["idx"] not in results]
+    chunks = [todo[i : i + chunksize] for i in range(0, len(todo), chunksize)]
+    if results:
+        print(f"Skipping {len(results)} unchanged pins, rendering {len(todo)}")
+
+    def record(chunk: List[dict], chunk_results: List[dict]) -> None:
+        for task, result in zip(chunk, chunk_results):
+            results[task["idx"]] = result
+        append_manifest(
+            manifest,
+            [manifest_entry(t, r) for t, r in zip(chunk, chunk_results)],
+        )
+
+    if workers == 1:
+        init_worker(font_path, font_size, project=project)
+        for chunk in chunks:
+            record(chunk, render_chunk(chunk))
+    elif chunks:
+        # Decode every background once here and share it with the workers
+        backgrounds = background_cache.publish([task["background"] for task in todo])
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_worker,
+                initargs=(font_path, font_size, backgrounds, project),
+            ) as pool:
+                # map keeps submission order, so results line up with the chunks
+                for chunk, chunk_results in zip(chunks, pool.map(render_chunk, chunks)):
+                    record(chunk, chunk_results)
+        finally:
+            background_cache.release()
+
+    return render_report(data, tasks, results)
+
+
+def render_caption_stream(
+    captions: Iterable[str],
+    font_path: str,
+    background_dir: str,
+    save_pattern: str,
+    csv_path: str,
+    text_color: str = "#0000",
+    font_size: int = 30,
+    wrap_block: int = 40,
+    workers: Optional[int] = None,
+    max_pending: Optional[int] = None,
+    seed: Optional[int] = None,
+    project: Optional[str] = None,
+    manifest: Optional[str] = None,
+) -> int:
+    """
+    Render captions as they arrive and append each finished row to a CSV.
+
+    Captions are pulled from the iterable in this process while the pool
+    renders the ones already received. At most max_pending renders are in
+    flight, so a slow pool applies back pressure on the caption stream. Rows
+    are written as soon as each render completes, so an interrupted run keeps
+    every pin it finished. With a manifest, pins unchanged since a previous
+    run are written straight to the CSV without rendering them again.
+
+    Parameters:
+    - captions (Iterable[str]): Captions, e.g. from creation_caption.stream_captions.
+    - font_path (str): The path to the font file.
+    - background_dir (str): Directory to pick backgrounds from.
+    - save_pattern (str): Output path with an "{idx}" placeholder.
+    - csv_path (str): CSV file the rows are written to, replaced on every run.
+    - text_color (str): The color of the text. Default is "#0000".
+    - font_size (int): The size of the font. Default is 30.
+    - wrap_block (int): The maximum width of the text block. Default is 40.
+    - workers (int, optional): Number of worker processes. Defaults to the CPU count.
+    - max_pending (int, optional): Renders in flight. Defaults to twice the workers.
+    - seed (int, optional): Seed for the background picks.
+    - project (str, optional): Project whose config drives the effects and layout. Defaults to the selected project.
+    - manifest (str, optional): JSON lines file recording each render, enables skipping unchanged pins.
+
+    Returns:
+    - int: The number of rows written.
+    """
+    render_kwargs = {
+        "font_path": font_path,
+        "text_color": text_color,
+        "font_size": font_size,
+        "wrap_block": wrap_block,
+        "params": get_config(project),
+    }
+    rng = random.Random(seed)
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    previous = load_manifest(manifest)
+    tasks = {}
+    written = 0
+
+    def write_row(task: dict, result: dict) -> None:
+        nonlocal written
+        row = {
+            "idx": task["idx"],
+            "caption": task["caption"],
+            "background": task["background"],
+            "images": result["images"],
+            "error": result["error"],
+        }
+        if result["error"]:
+            print(f"Failed to render caption {task['idx']}: {result['error']}")
+        pd.DataFrame([row]).to_csv(
+            csv_path, mode="a" if written else "w", header=not written, index=False
+        )
+        written += 1
+
+    def finish(future) -> None:
+        task = tasks.pop(future)
+        result = future.result()[0]
+        append_manifest(manifest, [manifest_entry(task, result)])
+        write_row(task, result)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(font_path, font_size, None, project),
+    ) as pool:
+        try:
+            for idx, caption in enumerate(captions):
+                task = _plan_task(
+                    idx,
+                    caption,
+                    background_dir,
+                    save_pattern,
+                    render_kwargs,
+                    rng,
+                    previous,
+                )
+                if task["skipped"]:
+                    write_row(task, {"images": task["save_to"], "error": None})
+                    continue
+                tasks[pool.submit(render_chunk, [task])] = task
+                if len(tasks) >= max_pending:
+                    done, _ = wait(list(tasks), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future)
+            for future in as_completed(list(tasks)):
+                finish(future)
+        except BaseException:
+            # Keep every finished pin, drop renders that have not started
+            for future in list(tasks):
+                future.cancel()
+                if future.done() and not future.cancelled():
+                    if future.exception() is None:
+                        finish(future)
+            raise
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render captioned images for a table of captions."
+    )
+    parser.add_argument(
+        "--project",
+        type=str,
+        default=None,
+        help="Project to render, defaults to the one selected in config.yaml",
+    )
+    parser.add_argument(
+        "--captions",
+        type=str,
+        default=None,
+        help="CSV file with a caption column, defaults to the project quotes.csv",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Where to write the render report, defaults to the captions file",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes")
+    parser.add_argument(
+        "--chunksize", type=int, default=None, help="Images per worker task"
+    )
+    parser.add_argument("--seed", type=int, default=None, help="Background seed")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render every pin again, starting a new manifest",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Time each stage and write a Chrome trace to tracing.path",
+    )
+    args = parser.parse_args()
+
+    params = get_config(args.project)
+    trace_path = start_tracing(params, force=args.trace)
+    project = params["project"]
+    render_params = params.get("render", {})
+    captions_path = args.captions or f"src/data/{project}/tables/quotes.csv"
+    manifest = render_params.get("manifest")
+    manifest = manifest.format(project) if manifest else None
+    if args.force and manifest and os.path.exists(manifest):
+        os.remove(manifest)
+
+    start = time.time()
+    data = pd.read_csv(captions_path).dropna(subset=["caption"])
+    data = render_captioned_images(
+        data,
+        font_path=os.path.join(
+            params["path"]["path_to_font"], params["font"]["font_type"]
+        ),
+        background_dir=params["background_dir"].format(project),
+        save_pattern=f"src/data/{project}/pins/{project}_template_{{idx}}.png",
+        text_color=params["font"]["text_color"],
+        font_size=params["font"]["font_size"],
+        wrap_block=params["font"]["wrap_block"],
+        workers=args.workers or render_params.get("workers"),
+        chunksize=args.chunksize or render_params.get("chunksize", 4),
+        seed=args.seed if args.seed is not None else render_params.get("seed"),
+        project=project,
+        manifest=manifest,
+    )
+    end = time.time()
+    print(
+        f"Rendered {data['error'].isna().sum()}/{len(data)} images in {end-start} seconds"
+    )
+    data.to_csv(args.output or captions_path, sep=",", index=False)
+    finish_tracing(trace_path)
+
+
+if __name__ == "__main__":
+    main()
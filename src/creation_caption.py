@@ -2,16 +2,124 @@ import openai
 import re
 import os
 import yaml
+import asyncio
+import hashlib
+import json
+import random
+import sqlite3
+import time
 import pandas as pd
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
+from processing.tracing import tracer
 
 # Load environment variables
 load_dotenv()
 api_key = os.environ.get("OPENAI_API_KEY")
 
+# Errors worth retrying, anything else is raised straight away
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+# Rough completion size of one caption, used to charge the token bucket
+TOKENS_PER_CAPTION = 50
+
+
+class CaptionCache:
+    """
+    On-disk cache of completions in SQLite, keyed by a hash of the request.
+
+    Entries expire after ttl seconds, and the least recently used ones are
+    evicted once the stored responses exceed max_bytes.
+    """
+
+    def __init__(
+        self,
+        path: str = "src/data/cache/captions.sqlite",
+        ttl: Optional[float] = 30 * 24 * 3600,
+        max_bytes: Optional[int] = 100 * 2**20,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # Opened on first use so importing this module never touches the disk
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS captions ("
+                "key TEXT PRIMARY KEY, response TEXT, size INTEGER, "
+                "created REAL, accessed REAL)"
+            )
+        return self._db
+
+    @staticmethod
+    def key(model: str, system: str, prompt: str, variant: int = 0) -> str:
+        """Content address of a request. variant tells apart repeated prompts."""
+        payload = json.dumps([model, system, prompt, variant])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.db.execute(
+            "SELECT response, created FROM captions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[1] > self.ttl):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.db:
+            self.db.execute(
+                "UPDATE captions SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        return row[0]
+
+    def set(self, key: str, response: str) -> None:
+        now = time.time()
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO captions VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+        self.evict()
+
+    def evict(self) -> None:
+        """Drop expired entries, then the least recently used ones over max_bytes."""
+        with self.db:
+            if self.ttl is not None:
+                self.db.execute(
+                    "DELETE FROM captions WHERE created < ?", (time.time() - self.ttl,)
+                )
+            if self.max_bytes is not None:
+                total = self.db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM captions"
+                ).fetchone()[0]
+                rows = self.db.execute(
+                    "SELECT key, size FROM captions ORDER BY accessed"
+                ).fetchall()
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self.db.execute("DELETE FROM captions WHERE key = ?", (key,))
+                    total -= size
+
 
 def create_caption(
-    prompt: str, system: str = "You are an expert Social Media Manager for Pinterest"
+    prompt: str,
+    system: str = "You are an expert Social Media Manager for Pinterest",
+    cache: Optional[CaptionCache] = None,
+    refresh: bool = False,
 ) -> str:
     openai.api_key = api_key
     payload = {
@@ -22,8 +130,16 @@ def create_caption(
         ],
     }
 
-    response = openai.ChatCompletion.create(**payload)
-    caption = response["choices"][0]["message"]["content"]
+    key = cache.key(payload["model"], system, prompt) if cache else None
+    caption = cache.get(key) if cache and not refresh else None
+    if caption is None:
+        with tracer.span("create_caption"):
+            response = openai.ChatCompletion.create(**payload)
+        caption = response["choices"][0]["message"]["content"]
+        if cache:
+            cache.set(key, caption)
+    else:
+        tracer.count("caption_cache_hits")
 
     # Remove the numbered bullet point from the start of the first caption
     caption = re.sub(r"^\d+\.\s*", "", caption)
@@ -31,17 +147,347 @@ def create_caption(
     return caption.replace('"', "")
 
 
-def create_caption_bulk(prompt: str) -> pd.DataFrame:
+def parse_captions(response: str) -> List[str]:
+    """Split a completion into captions and strip the numbered bullet points."""
+    captions_list = response.split("\n")
+    # Remove the numbered bullet point from the start of each caption
+    return [
+        re.sub(r"^\d+\.\s*", "", caption).replace("\n", "") for caption in captions_list
+    ]
+
+
+def create_caption_bulk(
+    prompt: str, cache: Optional[CaptionCache] = None, refresh: bool = False
+) -> pd.DataFrame:
     # Generate captions
     response = create_caption(
         prompt=prompt,
         system="You are an expert Social Media Manager for Pinterest and you provide captions separated by a \n",
+        cache=cache,
+        refresh=refresh,
     )
-    captions_list = response.split("\n")
-    # Remove the numbered bullet point from the start of each caption
-    captions_list = [
-        re.sub(r"^\d+\.\s*", "", caption).replace("\n", "") for caption in captions_list
-    ]
+    captions_list = parse_captions(response)
     # Create a DataFrame to store the captions
     data = pd.DataFrame(captions_list, columns=["caption"])
     return data
+
+
+def stream_captions(
+    prompt: str,
+    system: str = "You are an expert Social Media Manager for Pinterest and you provide captions separated by a \n",
+    model: str = "gpt-3.5-turbo",
+    api_base: Optional[str] = None,
+    cache: Optional[CaptionCache] = None,
+    refresh: bool = False,
+) -> Iterator[str]:
+    """
+    Yield captions one at a time while the completion is still streaming.
+
+    Args:
+        prompt (str): user prompt asking for captions separated by new lines.
+        system (str): system prompt.
+        model (str): chat model to use.
+        api_base (str, optional): API base URL, e.g. a local fake completion server.
+        cache (CaptionCache, optional): completion cache, a hit replays the stored captions.
+        refresh (bool): skip the cache lookup and overwrite the stored completion.
+
+    Yields:
+        str: each non-empty caption as soon as its line is complete.
+    """
+    key = cache.key(model, system, prompt) if cache else None
+    cached = cache.get(key) if cache and not refresh else None
+    if cached is not None:
+        for caption in parse_captions(cached.replace('"', "")):
+            if caption.strip():
+                yield caption.strip()
+        return
+
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt},
+        ],
+        "api_key": api_key,
+        "stream": True,
+    }
+    if api_base:
+        payload["api_base"] = api_base
+
+    text = ""
+    pending = ""
+    for chunk in openai.ChatCompletion.create(**payload):
+        delta = chunk["choices"][0].get("delta", {}).get("content") or ""
+        text += delta
+        pending += delta
+        # Every complete line is a caption, keep the tail for the next delta
+        *lines, pending = pending.split("\n")
+        for caption in parse_captions("\n".join(lines).replace('"', "")):
+            if caption.strip():
+                yield caption.strip()
+
+    for caption in parse_captions(pending.replace('"', "")):
+        if caption.strip():
+            yield caption.strip()
+    if cache:
+        cache.set(key, text)
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket refilled continuously at rate_per_minute.
+
+    acquire() waits until enough tokens are available, so callers sharing a
+    bucket stay under a requests-per-minute or tokens-per-minute limit.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1) -> None:
+        # A request bigger than the bucket would wait forever, cap it
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+
+async def create_caption_async(
+    prompt: str,
+    system: str = "You are an expert Social Media Manager for Pinterest",
+    model: str = "gpt-3.5-turbo",
+    api_base: Optional[str] = None,
+    max_retries: int = 5,
+    backoff: float = 1.0,
+    max_backoff: float = 60.0,
+    limiters: Tuple[Tuple[TokenBucket, float], ...] = (),
+    cache: Optional[CaptionCache] = None,
+    refresh: bool = False,
+    variant: int = 0,
+) -> str:
+    """
+    Async version of create_caption with rate limiting and retries.
+
+    Args:
+        prompt (str): user prompt.
+        system (str): system prompt.
+        model (str): chat model to use.
+        api_base (str, optional): API base URL, e.g. a local fake completion server.
+        max_retries (int): retries on rate limit, timeout and server errors.
+        backoff (float): base delay in seconds, doubled on every retry.
+        max_backoff (float): upper bound of a single delay in seconds.
+        limiters (Tuple[Tuple[TokenBucket, float], ...]): buckets to acquire before each attempt, with their cost.
+        cache (CaptionCache, optional): completion cache to read from and write to.
+        refresh (bool): skip the cache lookup and overwrite the stored completion.
+        variant (int): cache key suffix for prompts sent more than once, e.g. the chunk index.
+
+    Returns:
+        str: the completion without numbered bullet or quotes.
+    """
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt},
+        ],
+        "api_key": api_key,
+    }
+    if api_base:
+        payload["api_base"] = api_base
+
+    key = cache.key(model, system, prompt, variant) if cache else None
+    caption = cache.get(key) if cache and not refresh else None
+    if caption is None:
+        with tracer.span("create_caption_async", variant=variant):
+            response = await _acreate_with_retries(
+                payload, limiters, max_retries, backoff, max_backoff
+            )
+        caption = response["choices"][0]["message"]["content"]
+        if cache:
+            cache.set(key, caption)
+    else:
+        tracer.count("caption_cache_hits")
+
+    caption = re.sub(r"^\d+\.\s*", "", caption)
+    return caption.replace('"', "")
+
+
+async def _acreate_with_retries(
+    payload: dict,
+    limiters: Tuple[Tuple[TokenBucket, float], ...],
+    max_retries: int,
+    backoff: float,
+    max_backoff: float,
+) -> dict:
+    for attempt in range(max_retries + 1):
+        for bucket, cost in limiters:
+            await bucket.acquire(cost)
+        try:
+            return await openai.ChatCompletion.acreate(**payload)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            tracer.count("caption_retries")
+            # Full jitter, unless the server told us how long to wait
+            retry_after = (getattr(e, "headers", None) or {}).get("retry-after")
+            delay = random.uniform(0, min(max_backoff, backoff * 2**attempt))
+            if retry_after:
+                delay = max(delay, float(retry_after))
+            await asyncio.sleep(delay)
+
+
+async def iter_caption_chunks(
+    prompt_template: str,
+    n: int,
+    chunk_size: int = 10,
+    concurrency: int = 4,
+    rpm: Optional[float] = 60,
+    tpm: Optional[float] = None,
+    **kwargs,
+) -> AsyncIterator[Tuple[int, List[str]]]:
+    """
+    Generate n captions as concurrent chunked requests.
+
+    Chunks are yielded as soon as their completion arrives, not in order.
+
+    Args:
+        prompt_template (str): prompt with a literal "{n}" where the number of captions goes.
+        n (int): total number of captions.
+        chunk_size (int): captions asked for in a single request.
+        concurrency (int): maximum number of requests in flight.
+        rpm (float, optional): requests per minute limit.
+        tpm (float, optional): tokens per minute limit, estimated from the prompt length.
+        **kwargs: forwarded to create_caption_async.
+
+    Yields:
+        Tuple[int, List[str]]: chunk index and its captions.
+    """
+    system = kwargs.pop(
+        "system",
+        "You are an expert Social Media Manager for Pinterest and you provide captions separated by a \n",
+    )
+    sizes = [min(chunk_size, n - start) for start in range(0, n, chunk_size)]
+    request_bucket = TokenBucket(rpm) if rpm else None
+    token_bucket = TokenBucket(tpm) if tpm else None
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_chunk(idx: int, size: int) -> Tuple[int, List[str]]:
+        prompt = prompt_template.replace("{n}", str(size))
+        limiters = []
+        if request_bucket:
+            limiters.append((request_bucket, 1))
+        if token_bucket:
+            cost = (len(system) + len(prompt)) // 4 + TOKENS_PER_CAPTION * size
+            limiters.append((token_bucket, cost))
+        async with semaphore:
+            response = await create_caption_async(
+                prompt, system=system, limiters=tuple(limiters), variant=idx, **kwargs
+            )
+        captions = [caption for caption in parse_captions(response) if caption.strip()]
+        return idx, captions[:size]
+
+    tasks = [asyncio.ensure_future(run_chunk(i, size)) for i, size in enumerate(sizes)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def create_caption_bulk_async(
+    prompt_template: str,
+    n: int,
+    on_captions: Optional[Callable[[int, List[str]], None]] = None,
+    **kwargs,
+) -> pd.DataFrame:
+    """
+    Generate n captions concurrently and collect them in a DataFrame.
+
+    Args:
+        prompt_template (str): prompt with a literal "{n}" where the number of captions goes.
+        n (int): total number of captions.
+        on_captions (Callable, optional): called with (chunk index, captions) as each chunk arrives.
+        **kwargs: forwarded to iter_caption_chunks.
+
+    Returns:
+        pd.DataFrame: captions in chunk order with a "chunk" column.
+    """
+    chunks = []
+    async for idx, captions in iter_caption_chunks(prompt_template, n, **kwargs):
+        print(f"Chunk {idx}: {len(captions)} captions")
+        chunks.append(pd.DataFrame({"caption": captions, "chunk": idx}))
+        if on_captions:
+            on_captions(idx, captions)
+    if not chunks:
+        return pd.DataFrame(columns=["caption", "chunk"])
+    data = pd.concat(chunks, ignore_index=True)
+    return data.sort_values("chunk", kind="stable", ignore_index=True)
+
+
+def create_caption_bulk_concurrent(
+    prompt_template: str, n: int, **kwargs
+) -> pd.DataFrame:
+    """Blocking wrapper around create_caption_bulk_async."""
+    return asyncio.run(create_caption_bulk_async(prompt_template, n, **kwargs))
+
+
+def caption_prompt(params: dict) -> str:
+    """
+    Caption prompt of a project, with a literal "{n}" for the number of captions.
+
+    Args:
+        params (dict): project config.
+
+    Returns:
+        str: the prompt template for create_caption_bulk_concurrent and stream_captions.
+    """
+    line_text = params["line_text"]
+    caption_style = params["caption_style"]
+    topic = params["topic"]
+    language = params["language"]
+    social_media = params["social_media"]
+    # {n} is filled in per request, the caption engine splits n into chunks
+    return f"""
+Provide me a list of {{n}}  {line_text}  {caption_style} about {topic} in {language}. 
+They should fit the mood of a {social_media} post and contain high traffic keywords for {topic}.
+Separate each quote using a {params["sep"]} .
+{params["avoid_prompt"]}
+Try to use terms and keywords that have high SEO on {social_media}.
+Create the content only in {language}.
+Provide only the list with no additional content.
+
+Example output:
+{params["example"]}
+"""
+
+
+def caption_settings(params: dict, refresh: bool = False) -> dict:
+    """
+    Keyword arguments of create_caption_bulk_concurrent from the caption and caption_cache config.
+
+    Args:
+        params (dict): project config.
+        refresh (bool): ask OpenAI again instead of reusing cached captions.
+
+    Returns:
+        dict: the caption settings, with a fresh CaptionCache unless the cache is disabled.
+    """
+    caption_params = dict(params.get("caption", {}))
+    cache_params = dict(params.get("caption_cache", {}))
+    if cache_params.pop("enabled", True):
+        caption_params["cache"] = CaptionCache(**cache_params)
+    caption_params["refresh"] = refresh or caption_params.get("refresh", False)
+    return caption_params
@@ -1,21 +1,91 @@
-from typing import Tuple
+from typing import Optional, Tuple
 from PIL import Image, ImageDraw, ImageFont
-from processing.image_processing import image_effects
-from processing.text_processing import caption_effects
+from processing.image_processing import apply_effect_chain, background_cache
+from processing.caption_animation import AnimatedCaption, render_text_sprite
+from processing.output_formats import save_image
+from processing.placement import apply_local_overlay, place_text
 import functools
 import yaml
-from processing.text_processing import get_coords
-from config.config_utils import load_config
+from processing.text_processing import (
+    center_coords,
+    fit_layout,
+    font_registry,
+    layout_text,
+)
+from config.config_utils import get_config
+from processing.tracing import tracer, traced
 
 
-major_config = load_config("src/config/config.yaml")
-project = major_config["project"]
-minor_config = load_config(f"src/config/{project}/config.yaml")
-params = {**major_config, **minor_config}
+def _prepare_caption(
+    caption: str,
+    font_path: str,
+    img_path: str,
+    text_color: str,
+    font_size: int,
+    wrap_block: int,
+    text_coords: Tuple[float, float],
+    align: Optional[str],
+    font: Optional[ImageFont.FreeTypeFont],
+    params: Optional[dict],
+) -> tuple:
+    """Background with the effects and overlay, and where and how to draw the caption."""
+    params = params or get_config()
+    coords_params = params["font"]["text_coords"]
+    align = align or coords_params["align"]
+
+    with tracer.span("background_load"):
+        raw_image = background_cache.get(img_path)
+
+    image = apply_effect_chain(raw_image, params=params)
+
+    fit_params = params["font"].get("auto_fit") or {}
+    if fit_params.get("enabled"):
+        # Largest size that fits the box, font_size is the upper bound
+        box = (
+            int(image.width * fit_params.get("width", 0.8)),
+            int(image.height * fit_params.get("height", 0.6)),
+        )
+        font, layout = fit_layout(
+            caption,
+            font_path,
+            box,
+            fit_params.get("min_size", 24),
+            max(font_size, fit_params.get("min_size", 24)),
+            align,
+            index=params["font"].get("font_index", 0),
+        )
+    else:
+        if font is None:
+            font = font_registry.get(font_path, font_size)
+        # Wrapped and measured once per caption, whatever the background
+        layout = layout_text(
+            caption, font, wrap_block, align, params["font"].get("wrap_width")
+        )
+
+    # Get the coordinates for the text
+    if coords_params["auto"]:
+        text_coords = center_coords(image.size, layout)
+    else:
+        text_coords = (coords_params["width"], coords_params["height"])
+
+    contrast_params = dict(params["font"].get("contrast") or {})
+    if contrast_params.pop("enabled", False):
+        # Readable color and position for this background, plus a local overlay if needed
+        with tracer.span("place_text"):
+            placement = place_text(
+                image,
+                layout,
+                None if coords_params["auto"] else text_coords,
+                **contrast_params,
+            )
+        text_coords, text_color = placement.coords, placement.text_color
+        if placement.overlay:
+            image = apply_local_overlay(image, placement.overlay)
 
-align = params["font"]["text_coords"]["align"]
+    return image, font, layout, text_coords, text_color, align
 
 
+@traced()
 def create_captioned_image(
     caption: str,
     font_path: str,
@@ -25,8 +95,10 @@ def create_captioned_image(
     font_size: int = 30,
     wrap_block: int = 40,
     text_coords: Tuple[float, float] = (216.0, 453.6),
-    align: str = align,
-) -> None:
+    align: Optional[str] = None,
+    font: Optional[ImageFont.FreeTypeFont] = None,
+    params: Optional[dict] = None,
+) -> Image.Image:
     """
     Create a captioned image.
 
@@ -34,46 +106,100 @@ def create_captioned_image(
     - caption (str): The caption to add to the image.
     - font_path (str): The path to the font file.
     - img_path (str): The path to the image file.
-    - save_to (str): The path to save the captioned image.
+    - save_to (str): The path to save the captioned image in the image_processing.output format, None keeps it in memory only.
     - text_color (str): The color of the text. Default is "#0000".
     - font_size (int): The size of the font. Default is 30.
     - wrap_block (int): The maximum width of the text block. Default is 40.
     - text_coords (Tuple[float, float]): The x and y coordinates for the start of the text. Default is (216.0, 453.6).
     - effects (str) : effects filter on image.
+    - align (str, optional): Text alignment. Defaults to font.text_coords.align of the project config.
+    - font (ImageFont.FreeTypeFont, optional): Preloaded font to use instead of loading font_path, ignored by auto fit.
+    - params (dict, optional): Project config. Defaults to the selected project.
 
     Returns:
-    - image
+    - Image.Image: The rendered image, ready to hand to the video builder.
     """
-    font = ImageFont.truetype(font_path, font_size)
-    raw_image = Image.open(img_path)
-
-    image = image_effects(raw_image, effect="portrait")
-    image = image_effects(image, effect="overlay")
-
-    draw = ImageDraw.Draw(image)
-
-    caption_blocks = caption_effects(
-        caption=caption, effect=align, wrap_block=wrap_block
+    params = params or get_config()
+    image, font, layout, text_coords, text_color, align = _prepare_caption(
+        caption,
+        font_path,
+        img_path,
+        text_color,
+        font_size,
+        wrap_block,
+        text_coords,
+        align,
+        font,
+        params,
     )
 
-    # Get the coordinates for the text
-    if params["font"]["text_coords"]["auto"]:
-        text_coords = get_coords(image, wrap_block, caption_blocks, font)
-    else:
-        text_coords = (
-            params["font"]["text_coords"]["width"],
-            params["font"]["text_coords"]["height"],
+    with tracer.span("draw_text"):
+        ImageDraw.Draw(image).text(
+            text_coords,
+            layout.text,
+            font=font,
+            fill=text_color,
+            align=align,
+            spacing=layout.spacing,
         )
 
-    draw.text(
-        text_coords,
-        "\n".join(caption_blocks),
-        font=font,
-        fill=text_color,
-        align=align,
-    )
-
     if save_to:
-        image.save(save_to)
+        save_image(image, save_to, params)
 
     return image
+
+
+@traced()
+def create_animated_caption(
+    caption: str,
+    font_path: str,
+    img_path: str,
+    text_color: str = "#0000",
+    font_size: int = 30,
+    wrap_block: int = 40,
+    text_coords: Tuple[float, float] = (216.0, 453.6),
+    align: Optional[str] = None,
+    font: Optional[ImageFont.FreeTypeFont] = None,
+    params: Optional[dict] = None,
+    mode: str = "type",
+    reveal: float = 0.6,
+) -> AnimatedCaption:
+    """
+    Prepare a caption that types on or fades in over its video segment.
+
+    The background goes through the effects once and the text is drawn once
+    on a sprite, with the same layout, position and color as
+    create_captioned_image, so the last frame matches the still pin.
+
+    Parameters:
+    - caption (str): The caption to add to the image.
+    - font_path (str): The path to the font file.
+    - img_path (str): The path to the image file.
+    - text_color (str): The color of the text. Default is "#0000".
+    - font_size (int): The size of the font. Default is 30.
+    - wrap_block (int): The maximum width of the text block. Default is 40.
+    - text_coords (Tuple[float, float]): The x and y coordinates for the start of the text. Default is (216.0, 453.6).
+    - align (str, optional): Text alignment. Defaults to font.text_coords.align of the project config.
+    - font (ImageFont.FreeTypeFont, optional): Preloaded font to use instead of loading font_path, ignored by auto fit.
+    - params (dict, optional): Project config. Defaults to the selected project.
+    - mode (str): "type" reveals the glyphs one by one, "fade" fades the caption in. Default is "type".
+    - reveal (float): Share of the segment the reveal takes. Default is 0.6.
+
+    Returns:
+    - AnimatedCaption: The background and text sprite, for the video builder.
+    """
+    image, font, layout, text_coords, text_color, align = _prepare_caption(
+        caption,
+        font_path,
+        img_path,
+        text_color,
+        font_size,
+        wrap_block,
+        text_coords,
+        align,
+        font,
+        params,
+    )
+    sprite = render_text_sprite(layout, font, text_color, align)
+    coords = (int(round(text_coords[0])), int(round(text_coords[1])))
+    return AnimatedCaption(image, sprite, coords, mode=mode, reveal=reveal)
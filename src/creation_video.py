@@ -0,0 +1,199 @@
+import os
+import random
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from typing import Iterator, List, Optional, Union
+
+import cv2
+import pandas as pd
+from PIL import Image
+
+from config.config_utils import get_config
+from creation_batch import init_worker
+from creation_infographic import create_animated_caption, create_captioned_image
+from processing.background_index import pick_background
+from processing.caption_animation import AnimatedCaption, animation_settings
+from processing.image_processing import background_cache
+from processing.output_formats import get_image_writer, output_path
+from processing.tracing import traced
+from processing.video_processing import create_video_from_pins
+
+
+def _init_video_worker(
+    font_path: str,
+    font_size: int,
+    backgrounds: Optional[dict] = None,
+    project: Optional[str] = None,
+) -> None:
+    init_worker(font_path, font_size, backgrounds, project)
+    # Parallelism comes from the pool, keep OpenCV from oversubscribing cores
+    cv2.setNumThreads(1)
+
+
+def plan_video_jobs(
+    n_videos: int,
+    captions: List[str],
+    background_dir: str,
+    output_dir: str,
+    render_kwargs: dict,
+    video_kwargs: dict,
+    video_name: str = "output_video_{idx}.mp4",
+    seed: Optional[int] = None,
+    pins_dir: Optional[str] = None,
+) -> List[dict]:
+    """
+    Build one self-contained job per video.
+
+    Backgrounds are drawn here so the videos do not depend on which worker
+    renders them.
+
+    Parameters:
+    - n_videos (int): Number of videos.
+    - captions (List[str]): Caption of each image in a video.
+    - background_dir (str): Directory to pick backgrounds from.
+    - output_dir (str): Directory to write the videos to.
+    - render_kwargs (dict): Extra keyword arguments for create_captioned_image.
+    - video_kwargs (dict): Extra keyword arguments for create_video_from_pins.
+    - video_name (str): File name with an "{idx}" placeholder.
+    - seed (int, optional): Seed for the background picks.
+    - pins_dir (str, optional): Also save the pins, under one sub directory per video.
+
+    Returns:
+    - List[dict]: Video jobs in order.
+    """
+    rng = random.Random(seed)
+    params = render_kwargs.get("params") or {}
+    size = params.get("video_processing", {}).get("pin_size")
+    return [
+        {
+            "idx": idx,
+            "captions": list(captions),
+            "backgrounds": [
+                pick_background(background_dir, rng=rng, size=size, params=params)
+                for _ in captions
+            ],
+            "video_name": video_name.format(idx=idx),
+            "output_dir": output_dir,
+            "pins_dir": os.path.join(pins_dir, f"video_{idx}") if pins_dir else None,
+            "render_kwargs": render_kwargs,
+            "video_kwargs": video_kwargs,
+        }
+        for idx in range(n_videos)
+    ]
+
+
+def _render_pins(
+    job: dict, saves: List[Future]
+) -> Iterator[Union[Image.Image, AnimatedCaption]]:
+    """
+    Render the pins of a job lazily, saving them only if the job keeps them.
+
+    Kept pins are encoded on the image writer threads while the next pin is
+    composited, their futures are appended to saves for the job to wait on.
+    With video_processing.caption_animation enabled, the pins are animated
+    captions instead, and the saved pin is their fully revealed frame.
+    """
+    if job["pins_dir"]:
+        os.makedirs(job["pins_dir"], exist_ok=True)
+    params = job["render_kwargs"].get("params") or get_config()
+    animation = animation_settings(params)
+    for idx, (caption, background) in enumerate(
+        zip(job["captions"], job["backgrounds"])
+    ):
+        if animation is None:
+            pin = create_captioned_image(
+                caption=caption,
+                img_path=background,
+                save_to=None,
+                **job["render_kwargs"],
+            )
+        else:
+            pin = create_animated_caption(
+                caption=caption,
+                img_path=background,
+                **job["render_kwargs"],
+                **animation,
+            )
+        if job["pins_dir"]:
+            save_to = output_path(
+                os.path.join(job["pins_dir"], f"pin_{idx:03d}.png"), params
+            )
+            image = pin if animation is None else pin.final_image()
+            saves.append(get_image_writer(params).submit(image, save_to, params))
+        yield pin
+
+
+@traced()
+def render_video_job(job: dict) -> dict:
+    """
+    Render the pins of one video and encode them as they come out.
+
+    Pins go from the renderer to the encoder in memory, so there is no PNG
+    round trip and no shared folder to race on.
+
+    Parameters:
+    - job (dict): A job built by plan_video_jobs.
+
+    Returns:
+    - dict: The video path or the error.
+    """
+    video_path = os.path.join(job["output_dir"], job["video_name"])
+    saves: List[Future] = []
+    try:
+        try:
+            create_video_from_pins(
+                _render_pins(job, saves),
+                len(job["captions"]),
+                job["video_name"],
+                job["output_dir"],
+                **job["video_kwargs"],
+            )
+        finally:
+            # No pin is still being written once the job returns
+            wait(saves)
+        for save in saves:
+            save.result()
+        return {"idx": job["idx"], "video": video_path, "error": None}
+    except Exception as e:
+        return {"idx": job["idx"], "video": None, "error": f"{type(e).__name__}: {e}"}
+
+
+def render_videos(
+    jobs: List[dict], workers: Optional[int] = None, project: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Render video jobs concurrently, one process and VideoWriter per video.
+
+    Parameters:
+    - jobs (List[dict]): Jobs built by plan_video_jobs.
+    - workers (int, optional): Number of worker processes. Defaults to the CPU count, 1 renders in-process.
+    - project (str, optional): Project the workers warm up for. Defaults to the selected project.
+
+    Returns:
+    - pd.DataFrame: One row per video, in job order, with "video" and "error" columns.
+    """
+    if not jobs:
+        return pd.DataFrame(columns=["idx", "video", "error"])
+
+    render_kwargs = jobs[0]["render_kwargs"]
+    font_path, font_size = render_kwargs["font_path"], render_kwargs["font_size"]
+    if workers == 1:
+        init_worker(font_path, font_size, project=project)
+        results = [render_video_job(job) for job in jobs]
+    else:
+        backgrounds = background_cache.publish(
+            [background for job in jobs for background in job["backgrounds"]]
+        )
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_video_worker,
+                initargs=(font_path, font_size, backgrounds, project),
+            ) as pool:
+                results = list(pool.map(render_video_job, jobs))
+        finally:
+            background_cache.release()
+
+    results = pd.DataFrame(results)
+    for _, row in results[results["error"].notna()].iterrows():
+        print(f"Failed to render video {row['idx']}: {row['error']}")
+    return results
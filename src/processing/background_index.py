@@ -0,0 +1,276 @@
+import json
+import os
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from processing.image_processing import get_random_image_path, list_backgrounds
+
+INDEX_DIR = ".index"
+INDEX_VERSION = 1
+
+
+def size_key(size: Iterable[int]) -> str:
+    """Name of a variant size, e.g. "1000x1500"."""
+    width, height = size
+    return f"{int(width)}x{int(height)}"
+
+
+def analyze_background(image: Image.Image) -> dict:
+    """
+    Dominant color and mean luminance of a background, from a thumbnail.
+
+    Parameters:
+        - image (Image.Image): The decoded background.
+
+    Returns:
+        - dict: "dominant_color" as "#rrggbb" and "luminance" between 0 and 1.
+    """
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((64, 64))
+    quantized = thumbnail.quantize(colors=5)
+    _, index = max(quantized.getcolors())
+    red, green, blue = quantized.getpalette()[index * 3 : index * 3 + 3]
+    luminance = sum(thumbnail.convert("L").getdata()) / (
+        255 * thumbnail.width * thumbnail.height
+    )
+    return {
+        "dominant_color": f"#{red:02x}{green:02x}{blue:02x}",
+        "luminance": round(luminance, 4),
+    }
+
+
+class BackgroundIndex:
+    """
+    Index of a project's background library, with pre-scaled variants.
+
+    The index records the format, size, dominant color and luminance of each
+    background and is kept in an .index folder next to the backgrounds. A
+    refresh only opens files whose mtime or size changed. Variants are
+    cropped and scaled once to every target size, e.g. 1000x1500 for pins and
+    1080x1920 for videos, so renders never resize the originals.
+    """
+
+    def __init__(self, directory: str, sizes: Iterable[Iterable[int]] = ()):
+        self.directory = directory
+        self.sizes = [tuple(int(v) for v in size) for size in sizes]
+        self.index_dir = os.path.join(directory, INDEX_DIR)
+        self.entries: Dict[str, dict] = {}
+        self._names: List[str] = []
+        self._mtime: Optional[int] = None
+        self._load()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.index_dir, "index.json")
+
+    def _load(self) -> None:
+        try:
+            with open(self.index_path) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return
+        if index.get("version") == INDEX_VERSION:
+            self.entries = index["entries"]
+
+    def _save(self) -> None:
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"version": INDEX_VERSION, "entries": self.entries}, file)
+        os.replace(tmp_path, self.index_path)
+
+    def variant_path(self, name: str, size: Tuple[int, int]) -> str:
+        stem, ext = os.path.splitext(name)
+        # Keep transparency in png, everything else is stored as a jpeg
+        ext = ".png" if self.entries[name]["mode"] in ("RGBA", "LA", "P") else ".jpg"
+        return os.path.join(self.index_dir, size_key(size), stem + ext)
+
+    def _build_variant(self, image: Image.Image, name: str, size: Tuple[int, int]):
+        path = self.variant_path(name, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        mode = "RGBA" if path.endswith(".png") else "RGB"
+        variant = ImageOps.fit(image.convert(mode), size, Image.LANCZOS)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        variant.save(tmp_path, format="PNG" if mode == "RGBA" else "JPEG", quality=95)
+        os.replace(tmp_path, path)
+        return path
+
+    def _index_file(self, name: str, stat: os.stat_result) -> Optional[dict]:
+        path = os.path.join(self.directory, name)
+        try:
+            with Image.open(path) as img:
+                entry = {
+                    "format": img.format,
+                    "width": img.width,
+                    "height": img.height,
+                    "mode": img.mode,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "bytes": stat.st_size,
+                    "variants": {},
+                }
+                if self.sizes and img.format == "JPEG":
+                    # Decode huge jpegs at a reduced scale, still covering every variant
+                    img.draft(
+                        "RGB",
+                        (max(w for w, _ in self.sizes), max(h for _, h in self.sizes)),
+                    )
+                img.load()
+                entry.update(analyze_background(img))
+                self.entries[name] = entry
+                for size in self.sizes:
+                    entry["variants"][size_key(size)] = self._build_variant(
+                        img, name, size
+                    )
+        except (OSError, Image.DecompressionBombError) as e:
+            print(f"Skipping background {path}: {e}")
+            self.entries.pop(name, None)
+            return None
+        return entry
+
+    def refresh(self, force: bool = False) -> "BackgroundIndex":
+        """
+        Bring the index up to date with the background directory.
+
+        Only new or modified files are decoded, and missing variants of
+        unchanged files are built from the original. Does nothing when the
+        directory has not changed since the last refresh, unless force is set.
+
+        Parameters:
+            - force (bool): Check every file even if the directory mtime is unchanged.
+
+        Returns:
+            - BackgroundIndex: self, for chaining.
+        """
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self._mtime and not force:
+            return self
+
+        names = list_backgrounds(self.directory)
+        changed = False
+        for name in names:
+            stat = os.stat(os.path.join(self.directory, name))
+            entry = self.entries.get(name)
+            if (
+                entry is None
+                or entry["mtime_ns"] != stat.st_mtime_ns
+                or entry["bytes"] != stat.st_size
+            ):
+                self._index_file(name, stat)
+                changed = True
+                continue
+            missing = []
+            for size in self.sizes:
+                path = self.variant_path(name, size)
+                if not os.path.exists(path):
+                    missing.append(size)
+                elif entry["variants"].get(size_key(size)) != path:
+                    # Built by an index with other sizes
+                    entry["variants"][size_key(size)] = path
+                    changed = True
+            if missing:
+                with Image.open(os.path.join(self.directory, name)) as img:
+                    for size in missing:
+                        entry["variants"][size_key(size)] = self._build_variant(
+                            img, name, size
+                        )
+                changed = True
+
+        for name in set(self.entries) - set(names):
+            del self.entries[name]
+            changed = True
+
+        self._names = [name for name in names if name in self.entries]
+        self._mtime = mtime
+        if changed:
+            self._save()
+        return self
+
+    def paths(self, size: Optional[Iterable[int]] = None) -> List[str]:
+        """Paths of every background, or of its variant at size."""
+        if size is None:
+            return [os.path.join(self.directory, name) for name in self._names]
+        key = size_key(size)
+        return [self.entries[name]["variants"][key] for name in self._names]
+
+    def choice(
+        self, rng: Optional[random.Random] = None, size: Optional[Iterable[int]] = None
+    ) -> str:
+        """
+        Pick a background in constant time.
+
+        Parameters:
+            - rng (random.Random, optional): Random generator to draw from, for reproducible picks. Defaults to the global one.
+            - size (Tuple[int, int], optional): Return the variant of this size instead of the original.
+
+        Returns:
+            - str: The path to the background or its variant.
+        """
+        if not self._names:
+            raise FileNotFoundError(f"No background images in {self.directory}")
+        name = (rng or random).choice(self._names)
+        if size is None:
+            return os.path.join(self.directory, name)
+        return self.entries[name]["variants"][size_key(size)]
+
+
+# (directory, sizes) -> index, one per process
+_indexes: Dict[Tuple[str, tuple], BackgroundIndex] = {}
+
+
+def get_background_index(
+    directory: str, sizes: Iterable[Iterable[int]] = ()
+) -> BackgroundIndex:
+    """
+    The refreshed index of a background directory, shared within the process.
+
+    Parameters:
+        - directory (str): The background directory.
+        - sizes (Iterable[Tuple[int, int]]): Variant sizes to keep.
+
+    Returns:
+        - BackgroundIndex: The index, refreshed if the directory changed.
+    """
+    key = (os.path.abspath(directory), tuple(tuple(size) for size in sizes))
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes[key] = BackgroundIndex(directory, sizes)
+    return index.refresh()
+
+
+def background_sizes(params: dict) -> List[Tuple[int, int]]:
+    """Variant sizes asked for by a project config, for pins and for videos."""
+    sizes = [
+        params["image_processing"].get("pin_size"),
+        params["video_processing"].get("pin_size"),
+    ]
+    return sorted({tuple(size) for size in sizes if size})
+
+
+def pick_background(
+    directory: str,
+    rng: Optional[random.Random] = None,
+    size: Optional[Iterable[int]] = None,
+    params: Optional[dict] = None,
+) -> str:
+    """
+    Pick a background, or its pre-scaled variant when size is given.
+
+    Without a size this is get_random_image_path, no index is built. With a
+    size, the variants of every size in the config are kept in the index.
+
+    Parameters:
+        - directory (str): The background directory.
+        - rng (random.Random, optional): Random generator to draw from. Defaults to the global one.
+        - size (Tuple[int, int], optional): Size of the variant to return.
+        - params (dict, optional): Project config, for the variant sizes to build.
+
+    Returns:
+        - str: The path to the background or its variant.
+    """
+    if not size:
+        return get_random_image_path(directory, rng=rng)
+    sizes = set(background_sizes(params)) if params else set()
+    sizes.add(tuple(size))
+    return get_background_index(directory, sorted(sizes)).choice(rng, size)
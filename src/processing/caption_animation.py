@@ -0,0 +1,250 @@
+import math
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from processing.text_processing import TextLayout
+from processing.tracing import traced
+from processing.transitions import motion_frames
+
+ANIMATION_MODES = ("type", "fade")
+
+
+class TextSprite(NamedTuple):
+    """A caption drawn once on a transparent layer, with the reveal order of its pixels."""
+
+    image: Image.Image
+    # Top left corner of the sprite relative to the text coordinates
+    offset: Tuple[int, int]
+    # Index of the glyph each pixel belongs to, in reading order
+    order: np.ndarray
+    n_glyphs: int
+
+
+@traced("render_text_sprite")
+def render_text_sprite(
+    layout: TextLayout,
+    font: ImageFont.FreeTypeFont,
+    text_color: str,
+    align: str,
+) -> TextSprite:
+    """
+    Draw a wrapped caption on an RGBA layer cropped to its ink.
+
+    Glyph boxes follow Pillow's multiline layout: each line is aligned
+    inside the widest one and spaced by layout.line_spacing, and each glyph
+    starts at the advance of the text before it. Every pixel of a line band
+    gets the index of the glyph it falls under, so a type-on reveal is a
+    single comparison per frame.
+
+    Args:
+        layout (TextLayout): The wrapped caption, from layout_text or fit_layout.
+        font (ImageFont.FreeTypeFont): The font the layout was measured with.
+        text_color (str): Fill color of the text.
+        align (str): "left", "center" or "right".
+
+    Returns:
+        TextSprite: The layer, its offset, the per pixel glyph order and the glyph count.
+    """
+    probe = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    box = probe.multiline_textbbox(
+        (0, 0), layout.text, font=font, align=align, spacing=layout.spacing
+    )
+    # Centred and right aligned text has a fractional box, size the layer on whole pixels
+    left, top = math.floor(box[0]), math.floor(box[1])
+    right, bottom = math.ceil(box[2]), math.ceil(box[3])
+    width, height = max(1, right - left), max(1, bottom - top)
+    image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    ImageDraw.Draw(image).text(
+        (-left, -top),
+        layout.text,
+        font=font,
+        fill=text_color,
+        align=align,
+        spacing=layout.spacing,
+    )
+
+    order = np.zeros((height, width), dtype=np.float32)
+    block_width = max((font.getlength(line) for line in layout.lines), default=0)
+    glyph = 0
+    for row, line in enumerate(layout.lines):
+        line_width = font.getlength(line)
+        line_x = {
+            "center": (block_width - line_width) / 2,
+            "right": block_width - line_width,
+        }.get(align, 0)
+        # The band of a line runs to the top of the next one, the last to the bottom
+        y0 = max(0, int(row * layout.line_spacing) - top)
+        y1 = (
+            height
+            if row == len(layout.lines) - 1
+            else max(y0, int((row + 1) * layout.line_spacing) - top)
+        )
+        # Pixels left of the first glyph reveal with it, right of the last with the last
+        starts = [0] + [
+            int(line_x + font.getlength(line[: i + 1])) - left
+            for i in range(len(line) - 1)
+        ]
+        ends = starts[1:] + [width]
+        for start, end in zip(starts, ends):
+            order[y0:y1, max(0, start) : max(0, end)] = glyph
+            glyph += 1
+    return TextSprite(image, (left, top), order, max(1, glyph))
+
+
+class AnimatedCaption:
+    """
+    A background and a text sprite, composited per frame with a reveal mask.
+
+    The background already went through the image effects and the overlay,
+    and the text is drawn once, so a frame only blends the sprite's box with
+    an alpha mask built from the reveal progress. With "type" the glyphs
+    appear one after the other, with "fade" the whole caption fades in. The
+    caption is fully shown after the reveal share of its segment.
+    """
+
+    def __init__(
+        self,
+        background: Image.Image,
+        sprite: TextSprite,
+        coords: Tuple[int, int],
+        mode: str = "type",
+        reveal: float = 0.6,
+    ):
+        if mode not in ANIMATION_MODES:
+            raise ValueError(f"Unknown caption animation: {mode}")
+        self.background = background
+        self.sprite = sprite
+        self.coords = coords
+        self.mode = mode
+        self.reveal = reveal
+        self._arrays = None
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.background.size
+
+    @property
+    def origin(self) -> Tuple[int, int]:
+        """Top left corner of the sprite in the background."""
+        return (
+            self.coords[0] + self.sprite.offset[0],
+            self.coords[1] + self.sprite.offset[1],
+        )
+
+    def fit(self, frame_size: Tuple[int, int]) -> "AnimatedCaption":
+        """The same caption padded and scaled to frame_size like image_to_frame does."""
+        if self.size == tuple(frame_size):
+            return self
+        scale = min(frame_size[0] / self.size[0], frame_size[1] / self.size[1])
+        background = ImageOps.pad(self.background.convert("RGB"), frame_size)
+        # ImageOps.pad centres the scaled image
+        pad_x = (frame_size[0] - round(self.size[0] * scale)) // 2
+        pad_y = (frame_size[1] - round(self.size[1] * scale)) // 2
+        image, order = self.sprite.image, self.sprite.order
+        sprite_size = (
+            max(1, round(image.width * scale)),
+            max(1, round(image.height * scale)),
+        )
+        sprite = TextSprite(
+            image.resize(sprite_size, Image.LANCZOS),
+            (0, 0),
+            cv2.resize(order, sprite_size, interpolation=cv2.INTER_NEAREST),
+            self.sprite.n_glyphs,
+        )
+        x, y = self.origin
+        coords = (round(x * scale) + pad_x, round(y * scale) + pad_y)
+        return AnimatedCaption(background, sprite, coords, self.mode, self.reveal)
+
+    def _prepare(self) -> tuple:
+        # Converted once per segment, the frames only slice into these
+        if self._arrays is None:
+            background = cv2.cvtColor(
+                np.asarray(self.background.convert("RGB")), cv2.COLOR_RGB2BGR
+            )
+            rgba = np.asarray(self.sprite.image, dtype=np.float32)
+            alpha = rgba[..., 3:] / 255
+            color = cv2.cvtColor(rgba[..., :3], cv2.COLOR_RGB2BGR) * alpha
+            order = self.sprite.order[..., None]
+
+            # Clip the sprite box to the frame
+            x, y = self.origin
+            height, width = background.shape[:2]
+            x0, y0 = max(0, x), max(0, y)
+            x1 = min(width, x + alpha.shape[1])
+            y1 = min(height, y + alpha.shape[0])
+            sprite = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+            self._arrays = (
+                background,
+                (slice(y0, y1), slice(x0, x1)),
+                color[sprite],
+                alpha[sprite],
+                order[sprite],
+            )
+        return self._arrays
+
+    def mask(self, progress: float) -> np.ndarray:
+        """Share of each sprite pixel shown at a reveal progress from 0 to 1."""
+        _, _, _, alpha, order = self._prepare()
+        if self.mode == "fade":
+            return np.full_like(alpha, progress)
+        return np.clip(progress * self.sprite.n_glyphs - order, 0, 1)
+
+    def composite(self, background: np.ndarray, progress: float, out: np.ndarray):
+        """Blend the revealed text over a BGR background into out."""
+        _, box, color, alpha, _ = self._prepare()
+        np.copyto(out, background)
+        if progress <= 0 or alpha.size == 0:
+            return out
+        shown = self.mask(progress) if progress < 1 else 1.0
+        region = out[box].astype(np.float32)
+        region *= 1 - alpha * shown
+        region += color * shown
+        out[box] = region.astype(np.uint8)
+        return out
+
+    def frames(
+        self, n_frames: int, motion: str = "none", zoom: float = 1.1
+    ) -> Iterator[np.ndarray]:
+        """
+        BGR frames of the segment: the reveal, then the full caption.
+
+        The background moves with the motion while the text stays in place.
+        Frames share one buffer, so consume each frame before asking for the
+        next. Without motion the frames after the reveal are the same array.
+
+        Parameters:
+        - n_frames (int): Frames in the segment.
+        - motion (str): "zoom", "pan" or "none", applied to the background only.
+        - zoom (float): Zoom factor of the motion.
+
+        Yields:
+        - np.ndarray: The frames.
+        """
+        background = self._prepare()[0]
+        reveal_frames = max(1, round(n_frames * self.reveal))
+        buffer = np.empty_like(background)
+        still = motion not in ("zoom", "pan")
+        for i, moved in enumerate(motion_frames(background, n_frames, motion, zoom)):
+            progress = min(1.0, (i + 1) / reveal_frames)
+            if still and progress == 1 and i >= reveal_frames:
+                # Nothing changes any more
+                yield buffer
+                continue
+            yield self.composite(moved, progress, buffer)
+
+    def final_image(self) -> Image.Image:
+        """The fully revealed caption as an RGB image, e.g. to save the pin."""
+        background = self._prepare()[0]
+        frame = self.composite(background, 1.0, np.empty_like(background))
+        return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+def animation_settings(params: dict) -> Optional[dict]:
+    """The video_processing.caption_animation settings when enabled, else None."""
+    settings = dict(params.get("video_processing", {}).get("caption_animation") or {})
+    if not settings.pop("enabled", False):
+        return None
+    return settings
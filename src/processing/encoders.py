@@ -0,0 +1,221 @@
+import shutil
+import subprocess
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    import imageio_ffmpeg
+except ImportError:  # optional, bundles an ffmpeg binary
+    imageio_ffmpeg = None
+
+
+def find_ffmpeg(path: Optional[str] = None) -> Optional[str]:
+    """
+    Locate an ffmpeg executable.
+
+    Parameters:
+    - path (str, optional): Explicit path, e.g. video_processing.encoder.ffmpeg_path.
+
+    Returns:
+    - str: The executable, from path, the PATH or imageio-ffmpeg, None if there is none.
+    """
+    if path:
+        return shutil.which(path)
+    found = shutil.which("ffmpeg")
+    if found is None and imageio_ffmpeg is not None:
+        try:
+            found = imageio_ffmpeg.get_ffmpeg_exe()
+        except RuntimeError:
+            found = None
+    return found
+
+
+class OpenCVEncoder:
+    """
+    mp4v through cv2.VideoWriter, always available but large and single threaded.
+
+    VideoWriter has a constant frame rate, so a frame standing for
+    segment_frames frames is written that many times.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        frame_rate: float,
+        frame_size: Tuple[int, int],
+        fourcc: str = "mp4v",
+        segment_frames: int = 1,
+    ):
+        self.path = path
+        self.segment_frames = segment_frames
+        self.writer = cv2.VideoWriter(
+            path, cv2.VideoWriter_fourcc(*fourcc), frame_rate, frame_size
+        )
+        if not self.writer.isOpened():
+            raise RuntimeError(f"Failed to open video writer for {path}")
+
+    def write(self, frame: np.ndarray) -> None:
+        for _ in range(self.segment_frames):
+            self.writer.write(frame)
+
+    def close(self) -> None:
+        self.writer.release()
+
+
+class FFmpegEncoder:
+    """
+    H.264 through a local ffmpeg, fed raw BGR frames on a pipe.
+
+    x264 encodes on its own threads in the ffmpeg process while Python
+    produces the next frames, and the files are a fraction of the mp4v ones.
+    An audio file can be muxed in, looped or cut to the video length.
+
+    With segment_frames above 1 every frame written stands for that many
+    frames: the pipe runs at frame_rate / segment_frames, so a still is sent
+    once however long it shows. output_rate has ffmpeg repeat the frames up
+    to that rate, without it the file keeps the low rate of the pipe, one
+    frame per still.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        frame_rate: float,
+        frame_size: Tuple[int, int],
+        ffmpeg: str,
+        codec: str = "libx264",
+        preset: str = "veryfast",
+        crf: int = 23,
+        threads: int = 0,
+        pix_fmt: str = "yuv420p",
+        audio: Optional[str] = None,
+        audio_bitrate: str = "128k",
+        segment_frames: int = 1,
+        output_rate: Optional[float] = None,
+    ):
+        self.path = path
+        self.frame_size = tuple(frame_size)
+        width, height = self.frame_size
+        command = [
+            ffmpeg,
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "bgr24",
+            "-s",
+            f"{width}x{height}",
+            "-r",
+            f"{frame_rate}/{segment_frames}",
+            "-i",
+            "-",
+        ]
+        if audio:
+            command += ["-stream_loop", "-1", "-i", audio]
+        command += [
+            "-map",
+            "0:v:0",
+            "-c:v",
+            codec,
+            "-preset",
+            str(preset),
+            "-crf",
+            str(crf),
+            "-threads",
+            str(threads),
+            "-pix_fmt",
+            pix_fmt,
+            "-movflags",
+            "+faststart",
+        ]
+        if output_rate:
+            command += ["-r", str(output_rate)]
+        if audio:
+            command += ["-map", "1:a:0", "-c:a", "aac", "-b:a", audio_bitrate]
+            command += ["-shortest"]
+        command.append(path)
+        self.command = command
+        self.error: Optional[str] = None
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+    def write(self, frame: np.ndarray) -> None:
+        size = (frame.shape[1], frame.shape[0])
+        if size != self.frame_size:
+            raise ValueError(f"Frame of size {size} in a {self.frame_size} video")
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self._fail()
+
+    def close(self) -> None:
+        if self.error is not None:
+            # Already failed and reported by write
+            return
+        if self.process.stdin and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        if self.process.wait() != 0:
+            self._fail()
+
+    def _fail(self) -> None:
+        self.process.kill()
+        self.process.wait()
+        self.error = self.process.stderr.read().decode(errors="replace").strip()
+        raise RuntimeError(f"ffmpeg failed writing {self.path}: {self.error}")
+
+
+def open_encoder(
+    path: str,
+    frame_rate: float,
+    frame_size: Tuple[int, int],
+    backend: str = "auto",
+    ffmpeg_path: Optional[str] = None,
+    segment_frames: int = 1,
+    static_segments: Optional[str] = "frame_rate",
+    **options,
+):
+    """
+    Open the video encoder selected by the video_processing.encoder config.
+
+    Parameters:
+    - path (str): The video file to write.
+    - frame_rate (float): Frames per second.
+    - frame_size (Tuple[int, int]): (width, height) of the frames.
+    - backend (str): "ffmpeg", "opencv", or "auto" for ffmpeg when one is found. Default is "auto".
+    - ffmpeg_path (str, optional): The ffmpeg executable. Defaults to find_ffmpeg.
+    - segment_frames (int): Frames each written frame stands for, above 1 for stills. Default is 1.
+    - static_segments (str, optional): With segment_frames above 1, "frame_rate" has ffmpeg repeat each still at frame_rate, "segment_rate" keeps one frame per still at frame_rate / segment_frames, usually under 1 fps. Default is "frame_rate".
+    - **options: Settings of FFmpegEncoder: codec, preset, crf, threads, pix_fmt, audio, audio_bitrate.
+
+    Returns:
+    - FFmpegEncoder or OpenCVEncoder: An encoder with write(frame) and close().
+    """
+    if backend not in ("auto", "ffmpeg", "opencv"):
+        raise ValueError(f"Unknown video encoder backend: {backend}")
+    if static_segments not in (None, "segment_rate", "frame_rate"):
+        raise ValueError(f"Unknown static_segments mode: {static_segments}")
+    if backend != "opencv":
+        ffmpeg = find_ffmpeg(ffmpeg_path)
+        if ffmpeg:
+            return FFmpegEncoder(
+                path,
+                frame_rate,
+                frame_size,
+                ffmpeg,
+                segment_frames=segment_frames,
+                output_rate=frame_rate if static_segments == "frame_rate" else None,
+                **options,
+            )
+        if backend == "ffmpeg":
+            print("ffmpeg not found, falling back to the OpenCV encoder")
+    if options.get("audio"):
+        print(f"The OpenCV encoder cannot add audio, writing {path} without it")
+    return OpenCVEncoder(path, frame_rate, frame_size, segment_frames=segment_frames)
@@ -1,34 +1,72 @@
 from PIL import Image
 from typing import Callable, Dict, Tuple, Optional
 from PIL import Image, ImageFilter, ImageFont, ImageDraw
+from collections import OrderedDict
+from multiprocessing import shared_memory, util
 import functools
 import yaml
 import math
 import os
 import random
 from typing import List
-from src.config.config_utils import load_config
 
-major_config = load_config("src/config/config.yaml")
-project = major_config["project"]
-minor_config = load_config(f"src/config/{project}/config.yaml")
-params = {**major_config, **minor_config}
+try:
+    from config.config_utils import get_config
+    from processing.tracing import tracer
+except ImportError:  # imported from the repository root, e.g. by main.py
+    from src.config.config_utils import get_config
+    from src.processing.tracing import tracer
 
 
-def get_random_image_path(directory: str) -> str:
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+# directory -> (directory mtime, sorted image file names)
+_listings: Dict[str, Tuple[int, List[str]]] = {}
+
+
+def list_backgrounds(directory: str) -> List[str]:
+    """
+    Sorted image file names of a directory, listed again only when it changes.
+
+    Adding, removing or renaming a file changes the directory mtime, so the
+    listing is reused for every pin until that happens. Files that are not
+    images are left out.
+
+    Parameters:
+        - directory (str): The background directory.
+
+    Returns:
+        - List[str]: File names, not paths.
+    """
+    mtime = os.stat(directory).st_mtime_ns
+    cached = _listings.get(directory)
+    if cached is None or cached[0] != mtime:
+        with os.scandir(directory) as entries:
+            names = sorted(
+                entry.name
+                for entry in entries
+                if entry.is_file()
+                and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+            )
+        cached = _listings[directory] = (mtime, names)
+    return cached[1]
+
+
+def get_random_image_path(directory: str, rng: Optional[random.Random] = None) -> str:
     """
     Get a random image path from a specified directory.
 
     Parameters:
         - directory (str): The directory to get the random image from.
+        - rng (random.Random, optional): Random generator to draw from, for reproducible picks. Defaults to the global one.
 
     Returns:
         - str: The path to a randomly selected image.
     """
-    files = [
-        f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))
-    ]
-    return os.path.join(directory, random.choice(files))
+    files = list_backgrounds(directory)
+    if not files:
+        raise FileNotFoundError(f"No background images in {directory}")
+    return os.path.join(directory, (rng or random).choice(files))
 
 
 def read_image(image_path: str) -> Image:
@@ -45,6 +83,154 @@ def read_image(image_path: str) -> Image:
     return img
 
 
+class BackgroundCache:
+    """
+    LRU cache of decoded backgrounds, converted to RGBA once.
+
+    Entries are keyed by (path, mtime) so an edited file is decoded again, and
+    evicted least recently used first once the decoded size exceeds max_bytes.
+    The parent process can publish decoded backgrounds to shared memory and
+    pool workers attach to them, so each background is decoded once per run.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 2**20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Tuple[Image.Image, int]]" = OrderedDict()
+        self._bytes = 0
+        # key -> (shared memory name, size) for segments published by a parent
+        self._shared: Dict[tuple, Tuple[str, Tuple[int, int]]] = {}
+        # Open segments, kept alive while images reference their buffers
+        self._segments: Dict[str, shared_memory.SharedMemory] = {}
+        self._owned: List[str] = []
+        self._detach_finalizer: Optional[util.Finalize] = None
+
+    @staticmethod
+    def _key(path: str) -> tuple:
+        return (os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+    @staticmethod
+    def _decode(path: str) -> Image.Image:
+        with Image.open(path) as img:
+            return img.convert("RGBA")
+
+    def _insert(self, key: tuple, image: Image.Image, nbytes: int) -> None:
+        self._entries[key] = (image, nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, old_nbytes) = self._entries.popitem(last=False)
+            self._bytes -= old_nbytes
+
+    def get(self, path: str) -> Image.Image:
+        """
+        Return a decoded RGBA copy of a background.
+
+        Parameters:
+            - path (str): The path to the background image.
+
+        Returns:
+            - Image.Image: A copy that callers are free to draw on.
+        """
+        key = self._key(path)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0].copy()
+
+        if key in self._shared:
+            self.hits += 1
+            name, size = self._shared[key]
+            if name not in self._segments:
+                self._segments[name] = shared_memory.SharedMemory(name=name)
+            buffer = self._segments[name].buf
+            image = Image.frombuffer("RGBA", size, buffer, "raw", "RGBA", 0, 1)
+            # Shared entries live in the parent's memory, not in this budget
+            self._insert(key, image, 0)
+            return image.copy()
+
+        self.misses += 1
+        with tracer.span("background_decode"):
+            image = self._decode(path)
+        self._insert(key, image, image.width * image.height * 4)
+        return image.copy()
+
+    def publish(self, paths: List[str]) -> Dict[tuple, Tuple[str, Tuple[int, int]]]:
+        """
+        Decode backgrounds into shared memory for pool workers.
+
+        Stops publishing once max_bytes is reached, workers decode the rest
+        themselves.
+
+        Parameters:
+            - paths (List[str]): Backgrounds that the workers are going to use.
+
+        Returns:
+            - Dict: Descriptors to hand to attach() in each worker.
+        """
+        published = 0
+        for path in dict.fromkeys(paths):
+            key = self._key(path)
+            if key in self._shared:
+                continue
+            image = self._decode(path)
+            data = image.tobytes()
+            if published + len(data) > self.max_bytes:
+                break
+            segment = shared_memory.SharedMemory(create=True, size=len(data))
+            segment.buf[: len(data)] = data
+            self._segments[segment.name] = segment
+            self._owned.append(segment.name)
+            self._shared[key] = (segment.name, image.size)
+            published += len(data)
+        return dict(self._shared)
+
+    def attach(self, descriptors: Dict[tuple, Tuple[str, Tuple[int, int]]]) -> None:
+        """
+        Register shared backgrounds published by the parent process.
+
+        Segments are mapped on first use and closed by detach() when the
+        worker exits.
+        """
+        self._shared.update(descriptors)
+        # Pool workers exit without running atexit, and a forked child starts
+        # with an empty finalizer registry, so check it is still registered
+        if self._detach_finalizer is None or not self._detach_finalizer.still_active():
+            self._detach_finalizer = util.Finalize(self, self.detach, exitpriority=10)
+
+    def detach(self) -> None:
+        """Close the shared segments this process mapped but did not create."""
+        # Cached shared entries are views of the segments, drop them first
+        for key in [key for key in self._entries if key in self._shared]:
+            del self._entries[key]
+        for name in [name for name in self._segments if name not in self._owned]:
+            try:
+                self._segments[name].close()
+            except BufferError:
+                # An image still points into the segment, the exit unmaps it
+                continue
+            del self._segments[name]
+        for key, (name, _) in list(self._shared.items()):
+            if name not in self._owned:
+                del self._shared[key]
+
+    def release(self) -> None:
+        """Drop every entry and free the shared memory this process created."""
+        self._entries.clear()
+        self._bytes = 0
+        self._shared.clear()
+        for name, segment in self._segments.items():
+            segment.close()
+            if name in self._owned:
+                segment.unlink()
+        self._segments.clear()
+        self._owned.clear()
+
+
+# Budget is set from image_processing.background_cache_mb by the render workers
+background_cache = BackgroundCache()
+
+
 def apply_overlay(
     image: Image.Image, color: str = "#0000", alpha: float = 0.5
 ) -> Image.Image:
@@ -123,35 +309,125 @@ def apply_portrait(
     return img
 
 
-alpha = params["image_processing"]["alpha_overlay"]
-color_overlay = params["image_processing"]["color_overlay"]
-color_portrait = params["image_processing"]["color_portrait"]
-
-image_effect_dict = {
-    "portrait": functools.partial(apply_portrait, color=color_portrait),
-    "overlay": functools.partial(apply_overlay, color=color_overlay, alpha=alpha),
-    "blur": functools.partial(apply_blur, None),
-}
+def get_image_effect_dict(params: Optional[dict] = None) -> Dict[str, Callable]:
+    """Effect functions configured from the image_processing section of a project config."""
+    image_params = (params or get_config())["image_processing"]
+    return {
+        "portrait": functools.partial(
+            apply_portrait, color=image_params["color_portrait"]
+        ),
+        "overlay": functools.partial(
+            apply_overlay,
+            color=image_params["color_overlay"],
+            alpha=image_params["alpha_overlay"],
+        ),
+        "blur": apply_blur,
+    }
 
 
 def image_effects(
     image: Image,
     effect: str = None,
-    effect_dict: Dict[str, Callable] = image_effect_dict,
+    effect_dict: Optional[Dict[str, Callable]] = None,
 ) -> Image:
     """Applies the specified effect to the image.
 
     Args:
         image (Image): The image to apply the effect to.
         effect (str, optional): The name of the effect to apply. Defaults to None.
-        effect_dict (Dict[str, Callable], optional): A dictionary mapping effect names to functions. Defaults to None.
+        effect_dict (Dict[str, Callable], optional): A dictionary mapping effect names to functions. Defaults to the effects of the selected project.
 
 
     Returns:
         Image: The modified image, or the original image if no valid effect was specified.
     """
+    effect_dict = effect_dict or get_image_effect_dict()
     if effect in effect_dict:
-        image = effect_dict[effect](image)
+        with tracer.span(f"image_effects.{effect}"):
+            image = effect_dict[effect](image)
+
+    return image
+
+
+_overlay_luts: Dict[Tuple[str, float], List[int]] = {}
+
+
+def overlay_lut(color: str = "#0000", alpha: float = 0.5) -> List[int]:
+    """
+    Build the Image.point lookup table equivalent to apply_overlay.
+
+    A flat overlay blends every channel value with a constant, so the result
+    only depends on the input value and can be tabulated once per color and
+    alpha. The table is computed with Image.blend itself so the rounding is
+    identical.
+
+    Parameters:
+        - color (str, optional): The color of the overlay. Defaults to black "#0000".
+        - alpha (float, optional): The transparency of the overlay. Defaults to 0.5.
+
+    Returns:
+        - List[int]: 1024 entries, 256 for each RGBA band.
+    """
+    alpha = max(0, min(alpha, 1))
+    key = (color, alpha)
+    if key not in _overlay_luts:
+        band = Image.frombytes("L", (256, 1), bytes(range(256)))
+        ramp = Image.merge("RGBA", [band] * 4)
+        blended = Image.blend(ramp, Image.new("RGBA", ramp.size, color), alpha)
+        _overlay_luts[key] = [v for band in blended.split() for v in band.tobytes()]
+    return _overlay_luts[key]
+
+
+def apply_effect_chain(
+    image: Image.Image,
+    effects: Optional[List[str]] = None,
+    color_overlay: Optional[str] = None,
+    alpha: Optional[float] = None,
+    color_portrait: Optional[str] = None,
+    params: Optional[dict] = None,
+) -> Image.Image:
+    """
+    Apply a chain of effects with as few full-size copies as possible.
+
+    Gives the same pixels as calling image_effects once per effect, but the
+    overlay is a single Image.point pass over a cached lookup table instead of
+    allocating an overlay image and blending it, and the portrait frame is
+    drawn in place on the already converted buffer.
+
+    Parameters:
+        - image (Image.Image): The image to apply the effects to, modified in place when it is RGBA.
+        - effects (List[str], optional): Effect names in the order to apply them.
+        - color_overlay (str, optional): The color of the overlay.
+        - alpha (float, optional): The transparency of the overlay.
+        - color_portrait (str, optional): The color of the portrait frame.
+        - params (dict, optional): Project config for every setting not given. Defaults to the selected project.
+
+    Returns:
+        - Image.Image: The image with every effect applied.
+    """
+    if None in (effects, color_overlay, alpha, color_portrait):
+        image_params = (params or get_config())["image_processing"]
+        if effects is None:
+            effects = image_params.get("effects", ["portrait", "overlay"])
+        if color_overlay is None:
+            color_overlay = image_params["color_overlay"]
+        if alpha is None:
+            alpha = image_params["alpha_overlay"]
+        if color_portrait is None:
+            color_portrait = image_params["color_portrait"]
+
+    for effect in effects:
+        with tracer.span(f"image_effects.{effect}"):
+            if effect == "portrait":
+                image = apply_portrait(image, color=color_portrait)
+            elif effect == "overlay":
+                # Converted where apply_overlay would, a frame drawn before it
+                # on an L or P image takes that mode's color like it did there
+                if image.mode != "RGBA":
+                    image = image.convert("RGBA")
+                image = image.point(overlay_lut(color_overlay, alpha))
+            elif effect == "blur":
+                image = apply_blur(image)
 
     return image
 
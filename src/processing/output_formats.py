@@ -0,0 +1,187 @@
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Optional, Union
+
+from PIL import Image
+
+from processing.tracing import tracer
+
+# format name in the config -> (Pillow format, file extension, MIME type)
+OUTPUT_FORMATS = {
+    "png": ("PNG", ".png", "image/png"),
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+}
+
+
+def output_settings(params: Optional[dict]) -> dict:
+    """The image_processing.output section of a project config, png when missing."""
+    settings = dict(((params or {}).get("image_processing") or {}).get("output") or {})
+    settings.setdefault("format", "png")
+    if settings["format"] not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {settings['format']}")
+    return settings
+
+
+def output_path(path: str, params: Optional[dict]) -> str:
+    """path with the extension of the configured output format."""
+    extension = OUTPUT_FORMATS[output_settings(params)["format"]][1]
+    return os.path.splitext(path)[0] + extension
+
+
+def output_mime_type(params: Optional[dict]) -> str:
+    return OUTPUT_FORMATS[output_settings(params)["format"]][2]
+
+
+def flatten(
+    image: Image.Image, keep_alpha: bool = True, background: str = "#FFFFFF"
+) -> Image.Image:
+    """
+    Drop the alpha channel of an image that does not need it.
+
+    Fully opaque images become RGB. Transparent ones stay RGBA when
+    keep_alpha is set, else they are laid over the background color.
+
+    Parameters:
+    - image (Image.Image): The image to save.
+    - keep_alpha (bool): Keep real transparency, False for formats without alpha.
+    - background (str): Color behind transparent pixels when the alpha is dropped.
+
+    Returns:
+    - Image.Image: An RGB, L or RGBA image.
+    """
+    if image.mode not in ("RGBA", "LA", "PA") and not (
+        image.mode == "P" and "transparency" in image.info
+    ):
+        return image if image.mode in ("RGB", "L") else image.convert("RGB")
+    rgba = image.convert("RGBA")
+    if rgba.getchannel("A").getextrema()[0] == 255:
+        return rgba.convert("RGB")
+    if keep_alpha:
+        return rgba
+    base = Image.new("RGB", rgba.size, background)
+    base.paste(rgba, mask=rgba.getchannel("A"))
+    return base
+
+
+def save_image(
+    image: Image.Image,
+    target: Union[str, BinaryIO],
+    params: Optional[dict] = None,
+) -> str:
+    """
+    Encode an image in the output format of a project config.
+
+    Opaque RGBA images are written as RGB. Transparent ones keep their
+    alpha unless keep_alpha is off or the format is jpeg, then they are laid
+    over the background color.
+    png takes compress_level and, with colors set, is quantized to a
+    palette. webp takes quality, method and lossless. jpeg takes quality and
+    is written progressive and optimized unless progressive is off.
+
+    Parameters:
+    - image (Image.Image): The image to save.
+    - target (str or file): Path or binary file object to write to.
+    - params (dict, optional): Project config with the image_processing.output section.
+
+    Returns:
+    - str: The MIME type written.
+    """
+    settings = output_settings(params)
+    name = settings["format"]
+    pil_format, _, mime_type = OUTPUT_FORMATS[name]
+    image = flatten(
+        image,
+        keep_alpha=name != "jpeg" and settings.get("keep_alpha", True),
+        background=settings.get("background", "#FFFFFF"),
+    )
+
+    if name == "png":
+        options = {"compress_level": settings.get("compress_level", 6)}
+        if settings.get("colors"):
+            image = image.quantize(
+                colors=settings["colors"], method=Image.Quantize.FASTOCTREE
+            )
+    elif name == "webp":
+        options = {
+            "quality": settings.get("quality", 90),
+            "method": settings.get("method", 4),
+            "lossless": settings.get("lossless", False),
+        }
+    else:
+        progressive = settings.get("progressive", True)
+        options = {
+            "quality": settings.get("quality", 90),
+            "progressive": progressive,
+            "optimize": progressive,
+        }
+
+    with tracer.span("image_save", format=name):
+        image.save(target, format=pil_format, **options)
+    return mime_type
+
+
+def encode_image(image: Image.Image, params: Optional[dict] = None) -> tuple:
+    """(MIME type, bytes) of an image in the output format of a project config."""
+    buffer = io.BytesIO()
+    mime_type = save_image(image, buffer, params)
+    return mime_type, buffer.getvalue()
+
+
+class ImageWriter:
+    """
+    Saves images on a small thread pool.
+
+    Pillow releases the GIL while it compresses, so a render worker can
+    composite the next pin while the previous one is being encoded. At most
+    max_pending saves are queued, submit blocks beyond that so finished
+    images do not pile up in memory.
+    """
+
+    def __init__(self, threads: int = 2, max_pending: Optional[int] = None):
+        self.pool = ThreadPoolExecutor(
+            max_workers=max(1, threads), thread_name_prefix="image_save"
+        )
+        self._slots = threading.BoundedSemaphore(max_pending or 2 * max(1, threads))
+
+    def submit(
+        self, image: Image.Image, path: str, params: Optional[dict] = None
+    ) -> Future:
+        """Queue an image to save to path, the future raises what the save raised."""
+        self._slots.acquire()
+        try:
+            future = self.pool.submit(save_image, image, path, params)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+
+
+# One writer per process, created on first use
+_writer: Optional[ImageWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_image_writer(params: Optional[dict] = None) -> ImageWriter:
+    """The image writer of this process, sized by image_processing.output.encode_threads."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ImageWriter(output_settings(params).get("encode_threads", 2))
+    return _writer
+
+
+def _reset_image_writer() -> None:
+    # Pool threads do not survive a fork, a forked worker starts its own
+    global _writer, _writer_lock
+    _writer, _writer_lock = None, threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_image_writer)
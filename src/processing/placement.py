@@ -0,0 +1,208 @@
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+
+from processing.text_processing import TextLayout
+
+
+class Placement(NamedTuple):
+    """Where and in which color to draw a caption, and the overlay behind it."""
+
+    coords: Tuple[int, int]
+    text_color: str
+    # (box, rgba fill) of a local overlay behind the text, or None
+    overlay: Optional[Tuple[Tuple[int, int, int, int], Tuple[int, int, int, int]]]
+    contrast: float
+
+
+class LuminanceStats:
+    """
+    Integral images of the linear luminance of a downsampled image.
+
+    Mean and variance of any rectangle then cost four lookups each, whatever
+    its size, so many candidate text boxes can be scored per pin.
+    """
+
+    def __init__(self, image: Image.Image, max_side: int = 128):
+        self.scale = max(1, max(image.size) // max_side)
+        small = image.convert("L").reduce(self.scale)
+        srgb = np.asarray(small, dtype=np.float64) / 255
+        # Relative luminance is defined on linear light
+        linear = np.where(
+            srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4
+        )
+        self.height, self.width = linear.shape
+        self.sum = np.pad(linear.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+        self.sum_sq = np.pad((linear**2).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+
+    def region(self, box: Tuple[int, int, int, int]) -> Tuple[float, float]:
+        """
+        Mean and standard deviation of the luminance inside a box.
+
+        Args:
+            box (Tuple[int, int, int, int]): left, top, right, bottom in full size pixels.
+
+        Returns:
+            Tuple[float, float]: mean and standard deviation, between 0 and 1.
+        """
+        left, top, right, bottom = (int(round(v / self.scale)) for v in box)
+        left, right = max(0, min(left, self.width - 1)), max(1, min(right, self.width))
+        top, bottom = max(0, min(top, self.height - 1)), max(
+            1, min(bottom, self.height)
+        )
+        right, bottom = max(right, left + 1), max(bottom, top + 1)
+        area = (right - left) * (bottom - top)
+
+        def total(table: np.ndarray) -> float:
+            return (
+                table[bottom, right]
+                - table[top, right]
+                - table[bottom, left]
+                + table[top, left]
+            )
+
+        mean = total(self.sum) / area
+        variance = max(0.0, total(self.sum_sq) / area - mean**2)
+        return mean, variance**0.5
+
+
+def relative_luminance(color: str) -> float:
+    """WCAG relative luminance of a color."""
+    channels = np.array(ImageColor.getrgb(color)[:3], dtype=np.float64) / 255
+    linear = np.where(
+        channels <= 0.04045, channels / 12.92, ((channels + 0.055) / 1.055) ** 2.4
+    )
+    return float(linear @ [0.2126, 0.7152, 0.0722])
+
+
+def contrast_ratio(lum_a: float, lum_b: float) -> float:
+    """WCAG contrast ratio of two relative luminances, from 1 to 21."""
+    high, low = max(lum_a, lum_b), min(lum_a, lum_b)
+    return (high + 0.05) / (low + 0.05)
+
+
+def _worst_contrast(text_lum: float, mean: float, std: float) -> float:
+    # The background pixels closest to the text color limit readability
+    background = mean + std if text_lum > mean else mean - std
+    return contrast_ratio(text_lum, min(1.0, max(0.0, background)))
+
+
+def place_text(
+    image: Image.Image,
+    layout: TextLayout,
+    coords: Optional[Tuple[int, int]] = None,
+    light: str = "#FFFFFF",
+    dark: str = "#000000",
+    positions: int = 9,
+    margin: float = 0.05,
+    min_contrast: float = 4.5,
+    overlay: bool = True,
+    overlay_alpha_max: float = 0.6,
+    padding: float = 0.03,
+    stats: Optional[LuminanceStats] = None,
+) -> Placement:
+    """
+    Pick the text position, the text color and a local overlay for a caption.
+
+    Candidate boxes are centred horizontally and spread vertically inside
+    the margins, the centred one first. Each one is scored by the contrast
+    of the better of light and dark text against the background pixels
+    closest to it, the box mean plus or minus one standard deviation, so
+    busy regions lose to flat ones. When even the best box stays under
+    min_contrast, a translucent box of the opposite color is laid behind the
+    text, about opaque enough to reach it.
+
+    Args:
+        image (Image.Image): The background, after the effects.
+        layout (TextLayout): The wrapped caption.
+        coords (Tuple[int, int], optional): Fixed position, only the color and overlay are chosen.
+        light (str): Text color on dark backgrounds.
+        dark (str): Text color on light backgrounds.
+        positions (int): Number of vertical candidates.
+        margin (float): Share of the image height kept free at the top and bottom.
+        min_contrast (float): Contrast ratio to reach, 4.5 is WCAG AA for normal text.
+        overlay (bool): Add a local overlay when the contrast stays under min_contrast.
+        overlay_alpha_max (float): Most opaque the overlay may get.
+        padding (float): Overlay padding around the text, as a share of the shorter image side.
+        stats (LuminanceStats, optional): Precomputed statistics of image.
+
+    Returns:
+        Placement: position, color, overlay and the contrast reached.
+    """
+    stats = stats or LuminanceStats(image)
+    img_width, img_height = image.size
+    text_width, text_height = int(layout.width), int(layout.height)
+
+    if coords is not None:
+        candidates = [coords]
+    else:
+        x = (img_width - text_width) // 2
+        center = (img_height - text_height) // 2
+        low = int(img_height * margin)
+        high = max(low, int(img_height * (1 - margin)) - text_height)
+        spread = np.linspace(low, high, max(1, positions)).astype(int).tolist()
+        candidates = [(x, center)] + [(x, y) for y in spread if y != center]
+
+    light_lum, dark_lum = relative_luminance(light), relative_luminance(dark)
+    best = None
+    for x, y in candidates:
+        mean, std = stats.region((x, y, x + text_width, y + text_height))
+        for color, lum in ((light, light_lum), (dark, dark_lum)):
+            score = _worst_contrast(lum, mean, std)
+            # Clearly better only, so the centred box wins ties
+            if best is None or score > best[0] + 1e-3:
+                best = (score, (x, y), color, lum, mean, std)
+
+    score, position, color, lum, mean, std = best
+    box_overlay = None
+    if overlay and score < min_contrast:
+        x, y = position
+        pad = int(min(img_width, img_height) * padding)
+        box = (x - pad, y - pad, x + text_width + pad, y + text_height + pad)
+        # Pull the background towards the opposite of the text color
+        fill_lum = dark_lum if lum > mean else light_lum
+        fill = ImageColor.getrgb(dark if lum > mean else light)[:3]
+        if lum > mean:
+            target = (lum + 0.05) / min_contrast - 0.05
+            worst = min(1.0, mean + std)
+        else:
+            target = min_contrast * (lum + 0.05) - 0.05
+            worst = max(0.0, mean - std)
+        alpha = (target - worst) / (fill_lum - worst) if fill_lum != worst else 0.0
+        alpha = min(overlay_alpha_max, max(0.0, alpha))
+        if alpha > 0:
+            box_overlay = (box, (*fill, int(round(alpha * 255))))
+            worst = worst * (1 - alpha) + fill_lum * alpha
+            score = contrast_ratio(lum, worst)
+
+    return Placement(position, color, box_overlay, round(float(score), 2))
+
+
+def apply_local_overlay(
+    image: Image.Image,
+    overlay: Tuple[Tuple[int, int, int, int], Tuple[int, int, int, int]],
+) -> Image.Image:
+    """
+    Blend the local overlay of a Placement over an image.
+
+    Drawing a translucent fill straight onto an RGBA image replaces its
+    pixels, alpha included, so the box is drawn on a transparent layer and
+    composited instead. Pixels outside the box are left untouched.
+
+    Args:
+        image (Image.Image): The background, after the effects.
+        overlay (Tuple): (box, rgba fill), Placement.overlay.
+
+    Returns:
+        Image.Image: The image with the overlay blended in, RGBA stays RGBA.
+    """
+    box, fill = overlay
+    layer = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    ImageDraw.Draw(layer).rectangle(box, fill=fill)
+    if image.mode == "RGBA":
+        return Image.alpha_composite(image, layer)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.paste(layer, mask=layer.getchannel("A"))
+    return image
@@ -9,16 +9,9 @@ def load_params(file_path: str) -> dict:
         return yaml.safe_load(file)
 
 
-def create_directories(project: str):
-    os.makedirs(f"./data/{project}", exist_ok=True)
-    os.makedirs(f"./config/{project}", exist_ok=True)
-    os.makedirs(f"./data/{project}/videos", exist_ok=True)
-    os.makedirs(f"./data/{project}/videos/images", exist_ok=True)
-    os.makedirs(f"./data/{project}/background", exist_ok=True)
-    os.makedirs(f"./data/{project}/pins", exist_ok=True)
-
-    # Specify the content for config.yaml
-    config_content = """
+def project_config(project: str) -> str:
+    """Content of the config.yaml of a new project."""
+    return """
 avoid_prompt: >
   Do not write false informations
   Do not use emojis or hastags!.
@@ -35,7 +28,21 @@ font:
   font_type: "HATTEN.TTF"
   text_color: "#FFFF"
   font_size: 90
+  preload_sizes: [] # extra sizes loaded up front by the render workers
   wrap_block: 50
+  wrap_width: null # wrap on this width in pixels instead of wrap_block characters
+  auto_fit:
+    enabled: False # pick the largest size up to font_size that fits the box
+    min_size: 24
+    width: 0.8 # box as a share of the image width
+    height: 0.6 # box as a share of the image height
+  contrast:
+    enabled: False # pick the text color, position and a local overlay from the background
+    light: "#FFFFFF" # text color on dark backgrounds
+    dark: "#000000" # text color on light backgrounds
+    min_contrast: 4.5 # WCAG contrast ratio to reach
+    overlay: True # darken or lighten the text box when no position reaches min_contrast
+    overlay_alpha_max: 0.6
   text_coords:
     auto: True
     width: 180 #if auto is False
@@ -51,17 +58,60 @@ image_processing:
   alpha_overlay: 0.1
   color_overlay: "#0000"
   color_portrait: "#FFFFFF"
+  background_cache_mb: 512
+  effects: ["portrait", "overlay"] # applied in order, also "blur"
+  output:
+    format: "png" # png, webp or jpeg
+    quality: 90 # webp and jpeg quality
+    colors: null # quantize png to a palette of this many colors, e.g. 256
+    compress_level: 6 # png zlib level, 1 is fastest
+    method: 4 # webp effort, 0 is fastest, 6 smallest
+    keep_alpha: True # False lays see-through pins over background, jpeg always does
+    background: "#FFFFFF"
+    encode_threads: 2 # pins compressed in the background while the next one is composited
+  pin_size: null # e.g. [1000, 1500], render on backgrounds pre-scaled to this size
 
 video_processing:
   frame_rate: 15
   video_duration: 10
   images_in_video: 10
   width_resize: 800
+  workers: 2 # videos rendered at the same time
+  keep_pins: False # also save each video's pins as png
+  pin_size: null # e.g. [1080, 1920], render video pins on backgrounds pre-scaled to this size
+  transitions:
+    effect: "crossfade" # crossfade or none
+    duration: 0.5 # seconds of each crossfade
+    motion: "zoom" # zoom, pan or none
+    zoom: 1.1 # zoom factor of the motion
+  caption_animation:
+    enabled: False # type on or fade in the captions instead of baking them into the pins
+    mode: "type" # type or fade
+    reveal: 0.6 # share of each image's time the reveal takes
+  encoder:
+    backend: "auto" # ffmpeg (H.264) when an ffmpeg is found, else opencv (mp4v)
+    ffmpeg_path: null # defaults to ffmpeg on the PATH, then imageio-ffmpeg
+    preset: "veryfast" # x264 speed and size trade-off, ultrafast to veryslow
+    crf: 23 # quality, lower is better and larger
+    threads: 0 # x264 threads, 0 picks from the CPU count
+    audio: null # audio file muxed in, looped or cut to the video length
+    audio_bitrate: "128k"
+    static_segments: "frame_rate" # stills without crossfade or motion are sent once: frame_rate (ffmpeg repeats them at frame_rate), segment_rate (one frame per still, under 1 fps, often rejected by platforms) or null
     """.format(
         project, project, project, project
     )  # Replace placeholders with project name
 
+
+def create_directories(project: str):
+    os.makedirs(f"./data/{project}", exist_ok=True)
+    os.makedirs(f"./config/{project}", exist_ok=True)
+    os.makedirs(f"./data/{project}/videos", exist_ok=True)
+    os.makedirs(f"./data/{project}/videos/images", exist_ok=True)
+    os.makedirs(f"./data/{project}/background", exist_ok=True)
+    os.makedirs(f"./data/{project}/pins", exist_ok=True)
+
     # Create and write to config.yaml
+    config_content = project_config(project)
     with open(f"./config/{project}/config.yaml", "w") as config_file:
         config_file.write(config_content)
 
@@ -1,41 +1,243 @@
 from typing import Tuple, List
 import textwrap
-from typing import Callable, Dict, Tuple
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
 import functools
 import yaml
 from PIL import Image, ImageDraw, ImageFont
-from config.config_utils import load_config
+from processing.tracing import tracer, traced
 
-major_config = load_config("src/config/config.yaml")
-project = major_config["project"]
-minor_config = load_config(f"src/config/{project}/config.yaml")
-params = {**major_config, **minor_config}
 
+class FontRegistry:
+    """
+    Process-wide cache of parsed fonts keyed by (path, size, index).
 
-def get_coords(
-    img: Image.Image,
-    wrap_block: int,
-    caption_blocks: List[str],
-    font: ImageFont.FreeTypeFont,
-) -> Tuple[int, int]:
-    img_width, img_height = img.size
+    Parsing a large TTF is a measurable part of each render, so every font is
+    loaded once per process and shared by all the images that use it.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._fonts: Dict[Tuple[str, int, int], ImageFont.FreeTypeFont] = {}
+
+    def get(self, path: str, size: int, index: int = 0) -> ImageFont.FreeTypeFont:
+        """
+        Return the font for (path, size, index), loading it on first use.
+
+        Args:
+            path (str): path to the font file.
+            size (int): font size in points.
+            index (int): face to load from a font collection.
+
+        Returns:
+            ImageFont.FreeTypeFont: the cached font.
+        """
+        key = (path, int(size), index)
+        font = self._fonts.get(key)
+        if font is None:
+            self.misses += 1
+            font = ImageFont.truetype(path, int(size), index=index)
+            self._fonts[key] = font
+        else:
+            self.hits += 1
+        return font
+
+    def preload(self, params: dict) -> None:
+        """Load the fonts named in the font section of a project config."""
+        font_params = params["font"]
+        path = params["path"]["path_to_font"] + font_params["font_type"]
+        sizes = [font_params["font_size"], *font_params.get("preload_sizes", [])]
+        for size in sizes:
+            self.get(path, size, font_params.get("font_index", 0))
+
+    def stats(self) -> Dict[str, int]:
+        return {"fonts": len(self._fonts), "hits": self.hits, "misses": self.misses}
+
+
+font_registry = FontRegistry()
+
+
+class TextLayout(NamedTuple):
+    """A wrapped caption measured the way ImageDraw.text draws it."""
+
+    lines: Tuple[str, ...]
+    text: str
+    width: float
+    height: float
+    line_spacing: float
+    spacing: int
 
-    # Find the widest line of text
-    draw = ImageDraw.Draw(img)
-    text_width = max(
-        [draw.textbbox((0, 0), line, font=font)[2] for line in caption_blocks]
+
+@functools.lru_cache(maxsize=65536)
+def word_length(font: ImageFont.FreeTypeFont, word: str) -> float:
+    """Advance width of a word, cached per font."""
+    return font.getlength(word)
+
+
+def wrap_pixels(
+    caption: str, font: ImageFont.FreeTypeFont, max_width: float
+) -> List[str]:
+    """
+    Greedy word wrap on rendered width instead of character count.
+
+    Explicit line breaks in the caption are kept. A word wider than
+    max_width gets a line of its own.
+
+    Args:
+        caption (str): original caption.
+        font (ImageFont.FreeTypeFont): font the caption is drawn with.
+        max_width (float): maximum line width in pixels.
+
+    Returns:
+        List[str]: caption lines
+    """
+    space = word_length(font, " ")
+    lines = []
+    for paragraph in caption.split("\n"):
+        line, line_width = [], 0.0
+        for word in paragraph.split():
+            width = word_length(font, word)
+            if line and line_width + space + width > max_width:
+                lines.append(" ".join(line))
+                line, line_width = [], 0.0
+            line_width += (space if line else 0) + width
+            line.append(word)
+        if line:
+            lines.append(" ".join(line))
+    return lines
+
+
+def measure_lines(
+    lines: Tuple[str, ...], font: ImageFont.FreeTypeFont, spacing: int = 4
+) -> TextLayout:
+    """
+    Measure a block of lines with the same metrics as ImageDraw.text.
+
+    Lines are spaced by the height of "A" plus spacing, like Pillow's
+    multiline text, and the block spans the ascent of the first line to the
+    descent of the last one.
+
+    Args:
+        lines (Tuple[str, ...]): lines of the block.
+        font (ImageFont.FreeTypeFont): font the block is drawn with.
+        spacing (int): pixels between lines, as passed to ImageDraw.text.
+
+    Returns:
+        TextLayout: the measured block
+    """
+    line_spacing = font.getbbox("A")[3] + spacing
+    ascent, descent = font.getmetrics()
+    width = max((font.getlength(line) for line in lines), default=0)
+    height = (len(lines) - 1) * line_spacing + ascent + descent if lines else 0
+    return TextLayout(
+        tuple(lines), "\n".join(lines), width, height, line_spacing, spacing
     )
 
-    # Calculate the total height of the text block
-    text_height = len(caption_blocks) * (font.getmetrics()[1])
 
-    # Calculate the coordinates to center the text
-    x_coord = (img_width - text_width) // 2
-    y_coord = (img_height - text_height - wrap_block) // 2
+@functools.lru_cache(maxsize=4096)
+@traced("layout_text")
+def layout_text(
+    caption: str,
+    font: ImageFont.FreeTypeFont,
+    wrap_block: int,
+    align: str,
+    wrap_width: Optional[float] = None,
+    spacing: int = 4,
+) -> TextLayout:
+    """
+    Wrap and measure a caption once per (caption, font, size, wrap, align).
+
+    Fonts come from the font registry, so the font object stands for its
+    path and size. The layout does not depend on the background, so a
+    caption drawn on many backgrounds is laid out only once.
+
+    Args:
+        caption (str): original caption.
+        font (ImageFont.FreeTypeFont): font the caption is drawn with.
+        wrap_block (int): width of each block in characters.
+        align (str): effect to apply, see text_effect_dict.
+        wrap_width (float, optional): wrap on this width in pixels instead of wrap_block characters.
+        spacing (int): pixels between lines.
+
+    Returns:
+        TextLayout: the wrapped and measured caption
+    """
+    if wrap_width:
+        lines = wrap_pixels(caption, font, wrap_width)
+    else:
+        lines = caption_effects(caption=caption, effect=align, wrap_block=wrap_block)
+    return measure_lines(tuple(lines), font, spacing)
+
+
+@functools.lru_cache(maxsize=4096)
+def fit_layout(
+    caption: str,
+    font_path: str,
+    box: Tuple[int, int],
+    min_size: int,
+    max_size: int,
+    align: str,
+    spacing: int = 4,
+    index: int = 0,
+) -> Tuple[ImageFont.FreeTypeFont, TextLayout]:
+    """
+    Largest font size whose pixel-wrapped layout fits in box.
+
+    Binary search over the sizes, so a pin costs about log2(max_size -
+    min_size) layouts. Fonts come from the font registry and word widths from
+    the cached metrics, and the result is cached per caption and box.
+
+    Args:
+        caption (str): original caption.
+        font_path (str): path to the font file.
+        box (Tuple[int, int]): width and height the text has to fit in.
+        min_size (int): smallest size to try, used even if it overflows.
+        max_size (int): largest size to try.
+        align (str): text alignment.
+        spacing (int): pixels between lines.
+        index (int): face to load from a font collection.
+
+    Returns:
+        Tuple[ImageFont.FreeTypeFont, TextLayout]: the font and its layout
+    """
+    box_width, box_height = box
+
+    def attempt(size: int) -> Tuple[ImageFont.FreeTypeFont, TextLayout]:
+        font = font_registry.get(font_path, size, index)
+        return font, layout_text(caption, font, 0, align, box_width, spacing)
+
+    best = attempt(min_size)
+    low, high = min_size + 1, max_size
+    while low <= high:
+        size = (low + high) // 2
+        font, layout = attempt(size)
+        if layout.width <= box_width and layout.height <= box_height:
+            best = (font, layout)
+            low = size + 1
+        else:
+            high = size - 1
+    return best
 
+
+def center_coords(image_size: Tuple[int, int], layout: TextLayout) -> Tuple[int, int]:
+    """Top left corner that centers a layout on an image of image_size."""
+    img_width, img_height = image_size
+    x_coord = int(img_width - layout.width) // 2
+    y_coord = int(img_height - layout.height) // 2
     return (x_coord, y_coord)
 
 
+@traced()
+def get_coords(
+    img: Image.Image,
+    wrap_block: int,
+    caption_blocks: List[str],
+    font: ImageFont.FreeTypeFont,
+) -> Tuple[int, int]:
+    # wrap_block is no longer needed now that line heights include the ascent
+    return center_coords(img.size, measure_lines(tuple(caption_blocks), font))
+
+
 def apply_left(caption: str, wrap_block: int) -> List[str]:
     wrapper = textwrap.TextWrapper(width=wrap_block, expand_tabs=False)
     caption_blocks = wrapper.wrap(text=caption)
@@ -58,14 +260,14 @@ def apply_center(caption: str, wrap_block: int) -> List[str]:
     return caption_blocks
 
 
-wrap_block = params["font"]["wrap_block"]
 text_effect_dict = {
-    "left": functools.partial(apply_left, wrap_block=wrap_block),
-    "right": functools.partial(apply_right, wrap_block=wrap_block),
-    "center": functools.partial(apply_center, wrap_block=wrap_block),
+    "left": apply_left,
+    "right": apply_right,
+    "center": apply_center,
 }
 
 
+@traced()
 def caption_effects(
     caption: str,
     effect: str,
@@ -84,6 +286,6 @@ def caption_effects(
     """
 
     if effect in effect_dict:
-        caption_blocks = effect_dict[effect](caption)
+        caption_blocks = effect_dict[effect](caption, wrap_block=wrap_block)
 
     return caption_blocks
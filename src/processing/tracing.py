@@ -0,0 +1,239 @@
+import functools
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+from multiprocessing import util
+from typing import Callable, Dict, List, Optional
+
+# Set by Tracer.enable so pool workers started afterwards trace as well
+TRACE_ENV = "OPEN_CREATOR_TRACE"
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.tracer.record(self.name, self.start, time.perf_counter_ns(), self.args)
+
+
+class Tracer:
+    """
+    Spans and counters for one process, disabled by default.
+
+    Disabled, span() returns a shared no-op context manager and count() returns
+    at once, so instrumented code pays for an attribute check only. Enabled,
+    every span becomes a Chrome trace "complete" event. Pool workers write
+    their events to part files in a trace directory when they exit, and the
+    parent merges them with export().
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_dir: Optional[str] = None
+        self.events: List[dict] = []
+        self.counters: Counter = Counter()
+        self._lock = threading.Lock()
+        self._finalizer = None
+
+    def enable(self, trace_dir: Optional[str] = None, clear: bool = False) -> None:
+        """
+        Start recording.
+
+        Args:
+            trace_dir (str, optional): Directory for the part files of worker processes, needed to trace process pools.
+            clear (bool): Delete the part files of a previous run first.
+        """
+        self.enabled = True
+        if trace_dir:
+            if clear:
+                shutil.rmtree(trace_dir, ignore_errors=True)
+            os.makedirs(trace_dir, exist_ok=True)
+            self.trace_dir = trace_dir
+            os.environ[TRACE_ENV] = trace_dir
+            if self._finalizer is None:
+                self._register_finalizer()
+                util.register_after_fork(self, Tracer._register_finalizer)
+
+    def _register_finalizer(self) -> None:
+        # Runs when a pool worker exits, which atexit does not. Forked workers
+        # start with an empty finalizer registry, hence the after fork hook.
+        self._finalizer = util.Finalize(self, self.flush, exitpriority=100)
+
+    def disable(self) -> None:
+        self.enabled = False
+        os.environ.pop(TRACE_ENV, None)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.events.clear()
+            self.counters.clear()
+
+    def span(self, name: str, **args):
+        """Context manager timing a block as a span called name."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add value to the counter called name."""
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += value
+
+    def record(self, name: str, start_ns: int, end_ns: int, args: dict) -> None:
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": start_ns / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+
+    def flush(self) -> None:
+        """Write this process's events and counters to a part file in trace_dir."""
+        if not self.trace_dir:
+            return
+        pid = os.getpid()
+        with self._lock:
+            # A forked worker inherits the events of its parent, keep its own
+            events = [event for event in self.events if event["pid"] == pid]
+            counters = dict(self.counters)
+            self.events = [event for event in self.events if event["pid"] != pid]
+            self.counters.clear()
+        if not events and not counters:
+            return
+        path = os.path.join(self.trace_dir, f"part_{pid}_{time.time_ns()}.json")
+        with open(path, "w") as file:
+            json.dump({"events": events, "counters": counters}, file)
+
+    def collect(self) -> Dict[str, object]:
+        """Events and counters of this process and of every flushed worker."""
+        self.flush()
+        events, counters = list(self.events), Counter(self.counters)
+        if self.trace_dir:
+            for path in sorted(glob.glob(os.path.join(self.trace_dir, "part_*.json"))):
+                with open(path) as file:
+                    part = json.load(file)
+                events.extend(part["events"])
+                counters.update(part["counters"])
+        return {"events": events, "counters": counters}
+
+    def summary(self, collected: Optional[dict] = None) -> str:
+        """
+        Table of calls, total and mean time per span name, then the counters.
+
+        Args:
+            collected (dict, optional): Output of collect(). Defaults to collecting now.
+
+        Returns:
+            str: The table, slowest spans first.
+        """
+        collected = collected or self.collect()
+        totals: Dict[str, List[float]] = defaultdict(list)
+        for event in collected["events"]:
+            totals[event["name"]].append(event["dur"] / 1000)
+
+        lines = [f"{'span':<28}{'calls':>8}{'total ms':>12}{'mean ms':>10}"]
+        for name, durations in sorted(totals.items(), key=lambda item: -sum(item[1])):
+            total = sum(durations)
+            lines.append(
+                f"{name:<28}{len(durations):>8}{total:>12.1f}{total / len(durations):>10.2f}"
+            )
+        for name, value in sorted(collected["counters"].items()):
+            lines.append(f"{name:<28}{value:>8}")
+        return "\n".join(lines)
+
+    def export(self, path: str) -> str:
+        """
+        Write a Chrome trace (chrome://tracing, Perfetto) and return the summary.
+
+        Args:
+            path (str): The trace JSON file to write.
+
+        Returns:
+            str: The summary table.
+        """
+        collected = self.collect()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(
+                {
+                    "traceEvents": collected["events"],
+                    "otherData": {"counters": dict(collected["counters"])},
+                },
+                file,
+            )
+        return self.summary(collected)
+
+
+tracer = Tracer()
+if os.environ.get(TRACE_ENV):
+    tracer.enable(os.environ[TRACE_ENV])
+
+
+def start_tracing(params: dict, force: bool = False) -> Optional[str]:
+    """
+    Enable the tracer when the tracing section of a config, or force, asks for it.
+
+    Args:
+        params (dict): Project config.
+        force (bool): Trace even if tracing.enabled is off, e.g. for a --trace flag.
+
+    Returns:
+        str: The path the trace is going to be written to, None when not tracing.
+    """
+    tracing_params = params.get("tracing") or {}
+    if not (force or tracing_params.get("enabled")):
+        return None
+    path = tracing_params.get("path") or "trace.json"
+    tracer.enable(os.path.splitext(path)[0] + "_parts", clear=True)
+    return path
+
+
+def finish_tracing(path: Optional[str]) -> None:
+    """Write the Chrome trace started by start_tracing and print the summary table."""
+    if not path or not tracer.enabled:
+        return
+    print(tracer.export(path))
+    print(f"Chrome trace written to {path}")
+    tracer.disable()
+    shutil.rmtree(tracer.trace_dir, ignore_errors=True)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator recording every call of a function as a span."""
+
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
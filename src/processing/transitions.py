@@ -0,0 +1,144 @@
+from typing import Iterable, Iterator, Optional
+import cv2
+import numpy as np
+
+
+def motion_matrix(
+    width: int, height: int, t: float, motion: str = "zoom", zoom: float = 1.1
+) -> np.ndarray:
+    """
+    Affine matrix of a Ken Burns motion at time t.
+
+    Parameters:
+    - width (int): Frame width.
+    - height (int): Frame height.
+    - t (float): Progress through the segment, from 0 to 1.
+    - motion (str): "zoom" zooms in from 1 to zoom, "pan" slides across at a fixed zoom.
+    - zoom (float): Zoom factor, must be above 1 for a pan to have room to move.
+
+    Returns:
+    - np.ndarray: 2x3 matrix for cv2.warpAffine.
+    """
+    center = (width / 2, height / 2)
+    if motion == "zoom":
+        return cv2.getRotationMatrix2D(center, 0, 1 + (zoom - 1) * t)
+
+    matrix = cv2.getRotationMatrix2D(center, 0, zoom)
+    if motion == "pan":
+        margin = (zoom - 1) * width / 2
+        matrix[0, 2] += margin * (1 - 2 * t)
+    return matrix
+
+
+def motion_frames(
+    frame: np.ndarray, n_frames: int, motion: str = "zoom", zoom: float = 1.1
+) -> Iterator[np.ndarray]:
+    """
+    Animate a still frame with a zoom or pan.
+
+    Each frame is a single cv2.warpAffine over the whole image.
+
+    Parameters:
+    - frame (np.ndarray): The still frame.
+    - n_frames (int): Number of frames to generate.
+    - motion (str): "zoom", "pan" or "none".
+    - zoom (float): Zoom factor.
+
+    Yields:
+    - np.ndarray: The moving frames.
+    """
+    if motion not in ("zoom", "pan"):
+        for _ in range(n_frames):
+            yield frame
+        return
+
+    height, width = frame.shape[:2]
+    for i in range(n_frames):
+        t = i / max(1, n_frames - 1)
+        yield cv2.warpAffine(
+            frame,
+            motion_matrix(width, height, t, motion, zoom),
+            (width, height),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_REFLECT,
+        )
+
+
+def segment_frames(
+    image, n_frames: int, motion: str = "none", zoom: float = 1.1
+) -> Iterator[np.ndarray]:
+    """
+    Frames of one image's segment.
+
+    A still frame gets the motion. Anything else, e.g. an animated caption,
+    animates itself through its frames(n_frames, motion, zoom) method.
+    """
+    if isinstance(image, np.ndarray):
+        return motion_frames(image, n_frames, motion, zoom)
+    return image.frames(n_frames, motion, zoom)
+
+
+def static_transitions(transitions: Optional[dict]) -> bool:
+    """Whether transition settings leave every still unchanged for its whole segment."""
+    if not transitions:
+        return True
+    return transitions.get("effect", "crossfade") != "crossfade" and transitions.get(
+        "motion", "none"
+    ) not in ("zoom", "pan")
+
+
+def crossfade(
+    previous: np.ndarray, frame: np.ndarray, weight: float, out: Optional[np.ndarray]
+) -> np.ndarray:
+    """Blend previous into frame, weight is the share of frame."""
+    return cv2.addWeighted(previous, 1 - weight, frame, weight, 0, dst=out)
+
+
+def transition_frames(
+    images: Iterable[np.ndarray],
+    frames_per_image: int,
+    frame_rate: int,
+    effect: str = "crossfade",
+    duration: float = 0.5,
+    motion: str = "none",
+    zoom: float = 1.1,
+) -> Iterator[np.ndarray]:
+    """
+    Turn still frames into a video stream with motion and crossfades.
+
+    Every image still gets frames_per_image frames. With a crossfade, the
+    first frames of each image are blended with the last frame of the
+    previous one, so the video length does not change. Only the previous
+    frame and the current one are held in memory, and crossfaded frames share
+    one output buffer, so consume each frame before asking for the next.
+
+    Parameters:
+    - images (Iterable): BGR still frames of equal size, or animated captions of that size.
+    - frames_per_image (int): Frames generated for each image.
+    - frame_rate (int): Frames per second, used to convert duration to frames.
+    - effect (str): "crossfade" or "none".
+    - duration (float): Crossfade length in seconds.
+    - motion (str): "zoom", "pan" or "none".
+    - zoom (float): Zoom factor of the motion.
+
+    Yields:
+    - np.ndarray: The output frames.
+    """
+    fade_frames = 0
+    if effect == "crossfade":
+        fade_frames = min(frames_per_image, max(1, round(duration * frame_rate)))
+
+    previous = None
+    buffer = None
+    for image in images:
+        last = None
+        for i, frame in enumerate(
+            segment_frames(image, frames_per_image, motion, zoom)
+        ):
+            last = frame
+            if previous is not None and i < fade_frames:
+                if buffer is None:
+                    buffer = np.empty_like(frame)
+                frame = crossfade(previous, frame, (i + 1) / (fade_frames + 1), buffer)
+            yield frame
+        previous = last.copy() if last is not None else previous
@@ -1,62 +1,292 @@
-from PIL import Image
+from PIL import Image, ImageOps
 import cv2
+import itertools
 import os
 import numpy as np
 import yaml
+from processing.caption_animation import AnimatedCaption
+from processing.encoders import open_encoder
 from processing.image_processing import resize_image, read_image
-from typing import Optional, Tuple, Union
-from src.config.config_utils import load_config
+from processing.tracing import tracer
+from processing.transitions import (
+    segment_frames,
+    static_transitions,
+    transition_frames,
+)
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 
+try:
+    from config.config_utils import get_config
+except ImportError:  # imported from the repository root, e.g. by main.py
+    from src.config.config_utils import get_config
 
-major_config = load_config("src/config/config.yaml")
-project = major_config["project"]
-minor_config = load_config(f"src/config/{project}/config.yaml")
-params = {**major_config, **minor_config}
+
+def list_images(
+    image_folder: str,
+    extension: Union[str, Tuple[str, ...]] = (".png", ".webp", ".jpg"),
+) -> List[str]:
+    """Sorted paths of the images in a folder, so frame order is stable."""
+    return [
+        os.path.join(image_folder, img_name)
+        for img_name in sorted(os.listdir(image_folder))
+        if img_name.endswith(extension)
+    ]
 
 
 def check_image_sizes(image_paths):
-    sizes = {Image.open(img_path).size for img_path in image_paths}
+    # Image.open only parses the header, the pixels are never decoded here
+    sizes = set()
+    for img_path in image_paths:
+        with Image.open(img_path) as img:
+            sizes.add(img.size)
     return len(sizes) == 1, sizes.pop() if len(sizes) == 1 else None
 
 
-def load_and_resize_images(image_folder, width=None):
-    images = []
-    for img_name in os.listdir(image_folder):
-        if img_name.endswith(".png"):
-            with Image.open(os.path.join(image_folder, img_name)) as img:
-                if width is not None:
-                    img = resize_image(img, width=width)
-                images.append(cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR))
-    return images
+def fit_size(size: Tuple[int, int], max_size: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Scale (width, height) down so the longest side is at most max_size.
+
+    Both sides are rounded down to even numbers, which most codecs need.
+    """
+    width, height = size
+    if max_size is not None and max(width, height) > max_size:
+        scale = max_size / max(width, height)
+        width, height = round(width * scale), round(height * scale)
+    return max(2, width - width % 2), max(2, height - height % 2)
+
+
+def image_to_frame(img: Image.Image, frame_size: Tuple[int, int]) -> np.ndarray:
+    """Fit an image to frame_size, padding to keep the aspect ratio, as BGR."""
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    if img.size != frame_size:
+        img = ImageOps.pad(img, frame_size)
+    code = cv2.COLOR_RGBA2BGR if img.mode == "RGBA" else cv2.COLOR_RGB2BGR
+    return cv2.cvtColor(np.asarray(img), code)
+
+
+def pad_frame(frame: np.ndarray, frame_size: Tuple[int, int]) -> np.ndarray:
+    """
+    Fit a BGR array to frame_size like image_to_frame does, scaled and letterboxed.
+
+    Sizes and offsets follow ImageOps.pad, so a pin passed as an array lands
+    exactly where the same pin passed as an image would.
+    """
+    height, width = frame.shape[:2]
+    target_width, target_height = frame_size
+    if (width, height) == (target_width, target_height):
+        return frame
+    ratio = width / height
+    if ratio > target_width / target_height:
+        size = (target_width, round(target_width / ratio))
+    else:
+        size = (round(target_height * ratio), target_height)
+    if size != (width, height):
+        # Area averaging when shrinking, bicubic like ImageOps.pad when growing
+        shrink = size[0] < width
+        interpolation = cv2.INTER_AREA if shrink else cv2.INTER_CUBIC
+        frame = cv2.resize(frame, size, interpolation=interpolation)
+    left = round((target_width - size[0]) / 2)
+    top = round((target_height - size[1]) / 2)
+    return cv2.copyMakeBorder(
+        frame,
+        top,
+        target_height - size[1] - top,
+        left,
+        target_width - size[0] - left,
+        cv2.BORDER_CONSTANT,
+        value=0,
+    )
+
 
+def image_size(image: Union[str, Image.Image, np.ndarray]) -> Tuple[int, int]:
+    """(width, height) of an image path, PIL image or array, without decoding paths."""
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    if isinstance(image, str):
+        with Image.open(image) as img:
+            return img.size
+    return image.size
 
-frame_rate = params["video_processing"]["frame_rate"]
+
+def iter_frames(
+    images: Iterable[Union[str, Image.Image, np.ndarray]],
+    frame_size: Tuple[int, int],
+) -> Iterator[np.ndarray]:
+    """
+    Turn images into BGR video frames of frame_size, one at a time.
+
+    Parameters:
+    - images (Iterable): Image paths, PIL images, BGR arrays or animated captions, in frame order.
+    - frame_size (Tuple[int, int]): (width, height) of the frames.
+
+    Yields:
+    - np.ndarray: A BGR frame, or the animated caption fitted to frame_size.
+    """
+    for image in images:
+        if isinstance(image, AnimatedCaption):
+            # Composited per frame later, only the background is fitted here
+            yield image.fit(frame_size)
+        elif isinstance(image, np.ndarray):
+            yield pad_frame(image, frame_size)
+        elif isinstance(image, str):
+            with read_image(image) as img:
+                frame = image_to_frame(img, frame_size)
+            yield frame
+        else:
+            yield image_to_frame(image, frame_size)
 
 
 def create_video_from_images(
-    images, video_name, output_dir, duration, frame_rate=frame_rate
+    images,
+    video_name,
+    output_dir,
+    duration,
+    frame_rate=None,
+    n_images: Optional[int] = None,
+    transitions: Optional[dict] = None,
+    params: Optional[dict] = None,
+    encoder: Optional[dict] = None,
 ):
+    """
+    Write frames to an mp4, holding a single frame in memory at a time.
+
+    Without crossfade or motion, each image is handed to the encoder once
+    as a static segment, so the encode time follows the number of images
+    rather than the duration times the frame rate.
+
+    Parameters:
+    - images: BGR frames of equal size, or animated captions of that size, a list or any iterable.
+    - video_name (str): File name of the video.
+    - output_dir (str): Directory to write the video to.
+    - duration (int): Video duration in seconds.
+    - frame_rate (int, optional): Frames per second. Defaults to the project config.
+    - n_images (int, optional): Number of images, required when images is a generator.
+    - transitions (dict, optional): Keyword arguments of transitions.transition_frames, e.g. the video_processing.transitions config.
+    - params (dict, optional): Project config. Defaults to the selected project.
+    - encoder (dict, optional): Keyword arguments of encoders.open_encoder. Defaults to video_processing.encoder, {} for the default encoder.
+    """
+    if frame_rate is None or encoder is None:
+        video_params = (params or get_config())["video_processing"]
+        if frame_rate is None:
+            frame_rate = video_params["frame_rate"]
+        if encoder is None:
+            encoder = video_params.get("encoder") or {}
+    if n_images is None:
+        images = list(images)
+        n_images = len(images)
+    if n_images == 0:
+        print("No images to write")
+        return
+
     os.makedirs(output_dir, exist_ok=True)
     video_path = os.path.join(output_dir, video_name)
+    frames_per_image = (frame_rate * duration) // n_images
 
-    height, width, layers = images[0].shape
-    frames_per_image = (frame_rate * duration) // len(images)
-
-    video = cv2.VideoWriter(
-        video_path, cv2.VideoWriter_fourcc(*"mp4v"), frame_rate, (width, height)
-    )
-    if not video.isOpened():
-        print(f"Failed to open video writer")
+    images = iter(images)
+    first = next(images, None)
+    if first is None:
+        print("No images to write")
         return
+    images = itertools.chain([first], images)
+    repeat = 1
+    if (
+        encoder.get("static_segments", "frame_rate")
+        and static_transitions(transitions)
+        and isinstance(first, np.ndarray)
+        and frames_per_image > 0
+    ):
+        # Nothing moves within a segment, write each still once and let the
+        # encoder stretch it over frames_per_image frames
+        frames, repeat = images, frames_per_image
+    elif transitions:
+        frames = transition_frames(images, frames_per_image, frame_rate, **transitions)
+    else:
+        frames = (
+            frame
+            for image in images
+            for frame in segment_frames(image, frames_per_image)
+        )
 
-    for image in images:
-        for _ in range(frames_per_image):
-            video.write(image)
+    video = None
+    try:
+        for frame in frames:
+            tracer.count("frames", repeat)
+            if video is None:
+                height, width = frame.shape[:2]
+                video = open_encoder(
+                    video_path,
+                    frame_rate,
+                    (width, height),
+                    segment_frames=repeat,
+                    **encoder,
+                )
+            with tracer.span("video_write"):
+                video.write(frame)
+    finally:
+        if video is not None:
+            video.close()
 
-    video.release()
 
+def create_video_from_pins(
+    images: Iterable[Union[str, Image.Image, np.ndarray]],
+    n_images: int,
+    video_name: str,
+    output_dir: str,
+    video_duration: int = 5,
+    resize: bool = False,
+    frame_rate: int = 30,
+    max_size: Optional[int] = None,
+    transitions: Optional[dict] = None,
+    params: Optional[dict] = None,
+    encoder: Optional[dict] = None,
+) -> None:
+    """
+    Build a video straight from rendered images, with no files in between.
 
-width_resize = params["video_processing"]["width_resize"]
+    The frame size is taken from the first image, and every image is fitted
+    to it as it is consumed, so a generator of freshly rendered pins streams
+    into the encoder one frame at a time.
+
+    Parameters:
+    - images (Iterable): Image paths, PIL images or BGR arrays, in frame order.
+    - n_images (int): Number of images.
+    - video_name (str): File name of the video.
+    - output_dir (str): Directory to write the video to.
+    - video_duration (int): Video duration in seconds. Default is 5.
+    - resize (bool): Scale the frames down to max_size. Default is False.
+    - frame_rate (int): Frames per second. Default is 30.
+    - max_size (int, optional): Longest side of the frames when resizing. Defaults to video_processing.width_resize.
+    - transitions (dict, optional): Crossfade and motion settings, see transitions.transition_frames. Defaults to video_processing.transitions, {} for none.
+    - params (dict, optional): Project config. Defaults to the selected project.
+    - encoder (dict, optional): Encoder backend and settings, see encoders.open_encoder. Defaults to video_processing.encoder.
+    """
+    if (resize and max_size is None) or transitions is None or encoder is None:
+        video_params = (params or get_config())["video_processing"]
+        if max_size is None:
+            max_size = video_params["width_resize"]
+        if transitions is None:
+            transitions = video_params.get("transitions") or {}
+        if encoder is None:
+            encoder = video_params.get("encoder") or {}
+
+    images = iter(images)
+    first = next(images, None)
+    if first is None:
+        print("No images to write")
+        return
+
+    frame_size = fit_size(image_size(first), max_size if resize else None)
+    create_video_from_images(
+        iter_frames(itertools.chain([first], images), frame_size),
+        video_name,
+        output_dir,
+        video_duration,
+        frame_rate,
+        n_images=n_images,
+        transitions=transitions,
+        encoder=encoder,
+    )
 
 
 def process_images_and_create_video(
@@ -66,32 +296,50 @@ def process_images_and_create_video(
     video_duration: int = 5,
     resize: bool = False,
     frame_rate: int = 30,
-    max_size: Optional[Tuple[int, int]] = width_resize,
+    max_size: Optional[Tuple[int, int]] = None,
+    transitions: Optional[dict] = None,
+    params: Optional[dict] = None,
+    encoder: Optional[dict] = None,
 ) -> None:
-    images = []
-    for img_name in os.listdir(image_folder):
-        if img_name.endswith(".png"):
-            image_path = os.path.join(image_folder, img_name)
-            img = read_image(image_path)
-            if resize and max_size is not None:
-                print(000)
-                img = resize_image(img, max_size=max_size)
-            images.append(cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR))
-
-    same_size, img_size = check_image_sizes(
-        [
-            os.path.join(image_folder, img)
-            for img in os.listdir(image_folder)
-            if img.endswith(".png")
-        ]
-    )
+    """
+    Build a video from the pins of a folder in a single streaming pass.
+
+    Sizes are read from the file headers, then each image is decoded once,
+    fitted to the frame size and written straight to the video.
 
+    Parameters:
+    - image_folder (str): Folder with the png, webp or jpg pins, used in name order.
+    - video_name (str): File name of the video.
+    - output_dir (str): Directory to write the video to.
+    - video_duration (int): Video duration in seconds. Default is 5.
+    - resize (bool): Fit every image to the first one, scaled down to max_size. Default is False.
+    - frame_rate (int): Frames per second. Default is 30.
+    - max_size (int, optional): Longest side of the frames when resizing. Defaults to video_processing.width_resize.
+    - transitions (dict, optional): Crossfade and motion settings, see transitions.transition_frames. Defaults to video_processing.transitions, {} for none.
+    - params (dict, optional): Project config. Defaults to the selected project.
+    - encoder (dict, optional): Encoder backend and settings, see encoders.open_encoder. Defaults to video_processing.encoder.
+    """
+    image_paths = list_images(image_folder)
+    if not image_paths:
+        print(f"No images in {image_folder}")
+        return
+
+    same_size, img_size = check_image_sizes(image_paths)
     if not same_size and not resize:
         raise ValueError(
             "Images are not the same size and resize option is set to False."
         )
 
-    else:
-        images = load_and_resize_images(image_folder)  # No resizing needed
-
-    create_video_from_images(images, video_name, output_dir, video_duration, frame_rate)
+    create_video_from_pins(
+        image_paths,
+        len(image_paths),
+        video_name,
+        output_dir,
+        video_duration=video_duration,
+        resize=resize,
+        frame_rate=frame_rate,
+        max_size=max_size,
+        transitions=transitions,
+        params=params,
+        encoder=encoder,
+    )
@@ -0,0 +1,375 @@
+import argparse
+import json
+import os
+import shutil
+import signal
+import socketserver
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+import cv2
+
+from config.config_utils import discover_projects, get_config
+from creation_batch import init_worker, project_render_kwargs
+from creation_infographic import create_captioned_image
+from creation_video import plan_video_jobs, render_video_job
+from processing.background_index import (
+    background_sizes,
+    get_background_index,
+    pick_background,
+)
+from processing.image_processing import background_cache
+from processing.output_formats import encode_image, output_path
+
+
+def _init_server_worker(
+    font_path: str,
+    font_size: int,
+    backgrounds: Optional[dict] = None,
+    project: Optional[str] = None,
+) -> None:
+    init_worker(font_path, font_size, backgrounds, project)
+    # Requests already run side by side, keep OpenCV on one thread per worker
+    cv2.setNumThreads(1)
+
+
+def _inside(directory: str, name: str, allow_root: bool = False) -> str:
+    """
+    The real path of name inside directory, ValueError when it resolves outside of it.
+
+    name is a path from the working directory, like the ones in the config,
+    or a name relative to directory.
+    """
+    root = os.path.realpath(directory)
+
+    def contained(path: str) -> bool:
+        return path.startswith(root + os.sep) or (allow_root and path == root)
+
+    for path in (os.path.realpath(name), os.path.realpath(os.path.join(root, name))):
+        if contained(path):
+            return path
+    raise ValueError(f"{name!r} is not inside {directory}")
+
+
+def validate_request(path: str, request: dict) -> dict:
+    """
+    Check the project and the paths of a request before it reaches a worker.
+
+    The project must be one of the configured projects. A background is
+    only read from the project's background_dir, pins are only written to
+    its pins directory and videos to its path_to_video, so a client cannot
+    make a worker read or write other files. Symlinks are resolved before
+    the check.
+
+    Parameters:
+    - path (str): "/caption" or "/video".
+    - request (dict): The JSON body of the request.
+
+    Returns:
+    - dict: The request with its paths resolved.
+
+    Raises:
+    - ValueError: When the project is unknown or a path leaves its directory.
+    """
+    request = dict(request)
+    project = request.get("project")
+    if project is not None and project not in discover_projects():
+        raise ValueError(f"Unknown project {project!r}")
+    params = get_config(project)
+    project = params["project"]
+
+    if path == "/caption":
+        if request.get("background"):
+            request["background"] = _inside(
+                params["background_dir"].format(project), request["background"]
+            )
+        if request.get("save_to"):
+            request["save_to"] = _inside(f"src/data/{project}/pins", request["save_to"])
+    else:
+        if request.get("output_dir"):
+            request["output_dir"] = _inside(
+                params["path"]["path_to_video"].format(project),
+                request["output_dir"],
+                allow_root=True,
+            )
+        video_name = request.get("video_name")
+        if video_name and os.path.basename(video_name) != video_name:
+            raise ValueError(f"video_name {video_name!r} must be a file name")
+    return request
+
+
+def render_caption_request(request: dict) -> Tuple[str, bytes]:
+    """
+    Render one captioned pin inside a warm worker.
+
+    Parameters:
+    - request (dict): "caption", and optionally "project", "background", "save_to" and "return" ("path" or "bytes"), checked by validate_request.
+
+    Returns:
+    - Tuple[str, bytes]: The saved path, or the image bytes in the image_processing.output format when "return" is "bytes".
+    """
+    params = get_config(request.get("project"))
+    project = params["project"]
+    background = request.get("background") or pick_background(
+        params["background_dir"].format(project),
+        size=params["image_processing"].get("pin_size"),
+        params=params,
+    )
+
+    if request.get("return") == "bytes":
+        image = create_captioned_image(
+            caption=request["caption"],
+            img_path=background,
+            save_to=None,
+            **project_render_kwargs(params),
+        )
+        return encode_image(image, params)
+
+    save_to = request.get("save_to") or output_path(
+        os.path.join(
+            f"src/data/{project}/pins", f"{project}_server_{uuid.uuid4().hex}.png"
+        ),
+        params,
+    )
+    create_captioned_image(
+        caption=request["caption"],
+        img_path=background,
+        save_to=save_to,
+        **project_render_kwargs(params),
+    )
+    return "path", save_to.encode()
+
+
+def render_video_request(request: dict) -> Tuple[str, bytes]:
+    """
+    Render one video inside a warm worker.
+
+    Parameters:
+    - request (dict): "captions", and optionally "project", "video_name", "output_dir" and "return" ("path" or "bytes"), checked by validate_request.
+
+    Returns:
+    - Tuple[str, bytes]: The saved path, or the mp4 bytes when "return" is "bytes".
+    """
+    params = get_config(request.get("project"))
+    project = params["project"]
+    captions = request["captions"]
+    if isinstance(captions, str):
+        captions = [captions] * params["video_processing"]["images_in_video"]
+
+    as_bytes = request.get("return") == "bytes"
+    output_dir = (
+        tempfile.mkdtemp()
+        if as_bytes
+        else request.get("output_dir")
+        or params["path"]["path_to_video"].format(project)
+    )
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        (job,) = plan_video_jobs(
+            1,
+            captions=captions,
+            background_dir=params["background_dir"].format(project),
+            output_dir=output_dir,
+            render_kwargs=project_render_kwargs(params),
+            video_kwargs={
+                "video_duration": params["video_processing"]["video_duration"],
+                "resize": True,
+                "frame_rate": params["video_processing"]["frame_rate"],
+                "params": params,
+            },
+            video_name=request.get("video_name") or f"video_{uuid.uuid4().hex}.mp4",
+        )
+        result = render_video_job(job)
+        if result["error"]:
+            raise RuntimeError(result["error"])
+        if not as_bytes:
+            return "path", result["video"].encode()
+        with open(result["video"], "rb") as file:
+            return "video/mp4", file.read()
+    finally:
+        # A failed job may leave a partial mp4 in the temporary directory
+        if as_bytes:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+JOBS = {"/caption": render_caption_request, "/video": render_video_request}
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP front end of the render pool.
+
+    POST /caption and POST /video take a JSON body and answer with
+    {"path": ...} or with the raw file when the body asks for "return": "bytes".
+    GET /health reports the pool and the default project.
+    """
+
+    server_version = "OpenCreatorRender/1.0"
+
+    def address_string(self) -> str:
+        # Unix socket clients have no host/port pair
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _send(self, status: int, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        self._send(status, "application/json", json.dumps(payload).encode())
+
+    def do_GET(self) -> None:
+        if self.path != "/health":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        self._send_json(
+            200,
+            {
+                "status": "ok",
+                "project": self.server.project,
+                "workers": self.server.workers,
+            },
+        )
+
+    def do_POST(self) -> None:
+        job = JOBS.get(self.path)
+        if job is None:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            required = "caption" if self.path == "/caption" else "captions"
+            if not isinstance(request, dict) or required not in request:
+                raise ValueError(f"Missing '{required}'")
+            request = validate_request(self.path, request)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            kind, body = self.server.pool.submit(job, request).result()
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+
+        if kind == "path":
+            self._send_json(200, {"path": body.decode()})
+        else:
+            self._send(200, kind, body)
+
+
+def _stop(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8700,
+    socket_path: Optional[str] = None,
+    workers: Optional[int] = None,
+    project: Optional[str] = None,
+) -> None:
+    """
+    Serve render requests from a pool of warm workers until interrupted.
+
+    Workers import the rendering stack, load the config and the font, and
+    attach to the project backgrounds once at start up, so a request only
+    pays for the render itself. Other projects are loaded by a worker the
+    first time it is asked for them and stay cached.
+
+    Parameters:
+    - host (str): Interface to listen on. Default is "127.0.0.1".
+    - port (int): TCP port. Default is 8700.
+    - socket_path (str, optional): Listen on this Unix socket instead of TCP.
+    - workers (int, optional): Number of worker processes. Defaults to the CPU count.
+    - project (str, optional): Project to warm up for. Defaults to the selected project.
+    """
+    params = get_config(project)
+    project = params["project"]
+    render_kwargs = project_render_kwargs(params)
+    workers = workers or os.cpu_count() or 1
+
+    background_dir = params["background_dir"].format(project)
+    background_cache.max_bytes = (
+        params["image_processing"].get("background_cache_mb", 512) * 2**20
+    )
+    index = get_background_index(background_dir, background_sizes(params))
+    pin_size = params["image_processing"].get("pin_size")
+    backgrounds = background_cache.publish(index.paths(pin_size))
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, RenderHandler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), RenderHandler)
+        address = f"http://{host}:{server.server_address[1]}"
+
+    # Shut down the same way on SIGTERM as on Ctrl+C, freeing the shared backgrounds
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_server_worker,
+            initargs=(
+                render_kwargs["font_path"],
+                render_kwargs["font_size"],
+                backgrounds,
+                project,
+            ),
+        ) as pool:
+            # Start every worker now rather than on the first requests
+            list(pool.map(abs, range(workers)))
+            server.pool, server.project, server.workers = pool, project, workers
+            print(f"Serving {project} renders on {address} with {workers} workers")
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        background_cache.release()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve caption and video renders from warm workers."
+    )
+    parser.add_argument(
+        "--project",
+        type=str,
+        default=None,
+        help="Project to warm up for, defaults to the one selected in config.yaml",
+    )
+    parser.add_argument("--host", type=str, default=None, help="Interface")
+    parser.add_argument("--port", type=int, default=None, help="TCP port")
+    parser.add_argument(
+        "--socket", type=str, default=None, help="Unix socket path, replaces TCP"
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes")
+    args = parser.parse_args()
+
+    server_params = get_config(args.project).get("server", {})
+    serve(
+        host=args.host or server_params.get("host", "127.0.0.1"),
+        port=args.port if args.port is not None else server_params.get("port", 8700),
+        socket_path=args.socket or server_params.get("socket"),
+        workers=args.workers or server_params.get("workers"),
+        project=args.project,
+    )
+
+
+if __name__ == "__main__":
+    main()
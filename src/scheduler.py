@@ -0,0 +1,345 @@
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config.config_utils import discover_projects, get_config
+from creation_batch import (
+    append_manifest,
+    load_manifest,
+    manifest_entry,
+    plan_renders,
+    project_render_kwargs,
+    render_chunk,
+    render_report,
+)
+from creation_caption import (
+    caption_prompt,
+    caption_settings,
+    create_caption_bulk_concurrent,
+)
+from processing.image_processing import background_cache
+from processing.text_processing import font_registry
+from processing.tracing import finish_tracing, start_tracing, tracer
+
+
+def generate_captions(project: str, refresh: bool = False) -> pd.DataFrame:
+    """
+    Generate the captions of a project, as create_image_template does.
+
+    Runs on a caption thread, the requests of the project share the event
+    loop of that thread and its caption.concurrency limit.
+
+    Parameters:
+    - project (str): The project to write captions for.
+    - refresh (bool): Ask OpenAI again instead of reusing cached captions.
+
+    Returns:
+    - pd.DataFrame: The stripped captions, empty ones dropped.
+    """
+    params = get_config(project)
+    with tracer.span("scheduler.captions", project=project):
+        data = (
+            create_caption_bulk_concurrent(
+                caption_prompt(params),
+                params["create"],
+                **caption_settings(params, refresh=refresh),
+            )
+            .replace("", np.nan)
+            .dropna()
+        )
+    data["caption"] = data["caption"].str.strip()
+    return data
+
+
+def init_scheduler_worker(projects: List[str]) -> None:
+    """Warm the config and the fonts of every project once per worker."""
+    cache_mb = 0
+    for project in projects:
+        params = get_config(project)
+        font_registry.preload(params)
+        cache_mb = max(
+            cache_mb, params["image_processing"].get("background_cache_mb", 512)
+        )
+    background_cache.max_bytes = cache_mb * 2**20
+
+
+class ProjectRun:
+    """
+    Render state of one project inside the scheduler.
+
+    Holds the planned chunks still waiting for a render slot, the chunks in
+    flight and the results so far. Outputs, quotes.csv and the manifest are
+    the same files create_image_template writes for the project.
+    """
+
+    def __init__(self, project: str, quota: int, force: bool = False):
+        self.project = project
+        self.params = get_config(project)
+        self.quota = quota
+        self.quotes_path = f"src/data/{project}/tables/quotes.csv"
+        self.save_pattern = f"src/data/{project}/pins/{project}_template_{{idx}}.png"
+        manifest = self.params.get("render", {}).get("manifest")
+        self.manifest = manifest.format(project) if manifest else None
+        if force and self.manifest and os.path.exists(self.manifest):
+            os.remove(self.manifest)
+
+        self.data: Optional[pd.DataFrame] = None
+        self.error: Optional[str] = None
+        self.tasks: List[dict] = []
+        self.results: Dict[int, dict] = {}
+        self.queue: deque = deque()
+        self.in_flight = 0
+        self.start = time.time()
+
+    def plan(self, data: pd.DataFrame, chunksize: int) -> None:
+        """Save the captions, then queue the chunks of pins that changed."""
+        render_params = self.params.get("render", {})
+        self.data = data
+        # Keep the captions even if rendering is interrupted
+        data.to_csv(self.quotes_path, sep=",", index=False)
+        previous = load_manifest(self.manifest)
+        self.tasks = plan_renders(
+            data,
+            self.params["background_dir"].format(self.project),
+            self.save_pattern,
+            project_render_kwargs(self.params),
+            seed=render_params.get("seed"),
+            previous=previous,
+        )
+        todo = []
+        for task in self.tasks:
+            if task["skipped"]:
+                self.results[task["idx"]] = {
+                    "idx": task["idx"],
+                    "images": task["save_to"],
+                    "error": None,
+                }
+            else:
+                todo.append(task)
+        self.queue.extend(
+            todo[i : i + chunksize] for i in range(0, len(todo), chunksize)
+        )
+        print(
+            f"{self.project}: {len(data)} captions, "
+            f"{len(self.results)} unchanged, {len(todo)} to render"
+        )
+
+    def record(self, chunk: List[dict], chunk_results: List[dict]) -> None:
+        self.in_flight -= 1
+        for task, result in zip(chunk, chunk_results):
+            self.results[task["idx"]] = result
+        append_manifest(
+            self.manifest,
+            [manifest_entry(t, r) for t, r in zip(chunk, chunk_results)],
+        )
+
+    @property
+    def ready(self) -> bool:
+        """Whether a chunk is waiting and the project is under its quota."""
+        return bool(self.queue) and self.in_flight < self.quota
+
+    @property
+    def done(self) -> bool:
+        return self.error is not None or (
+            self.data is not None and not self.queue and not self.in_flight
+        )
+
+    def finish(self) -> Optional[pd.DataFrame]:
+        """Write the render report to quotes.csv, None if the project failed before rendering."""
+        if self.error is not None:
+            print(f"{self.project}: failed before rendering, {self.error}")
+            return None
+        data = render_report(self.data, self.tasks, self.results)
+        data.to_csv(self.quotes_path, sep=",", index=False)
+        print(
+            f"{self.project}: rendered {data['error'].isna().sum()}/{len(data)} "
+            f"images in {time.time() - self.start:.1f} seconds"
+        )
+        return data
+
+
+def schedule_projects(
+    projects: List[str],
+    caption_workers: int = 4,
+    render_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    project_quota: Optional[int] = None,
+    chunksize: int = 4,
+    refresh: bool = False,
+    force: bool = False,
+) -> Dict[str, Optional[pd.DataFrame]]:
+    """
+    Generate and render the pins of several projects at once.
+
+    Caption generation waits on the network, so it runs on a thread pool,
+    one project per thread. Rendering is CPU bound and runs on one process
+    pool shared by every project. A project's chunks are queued as soon as
+    its captions arrive, so its renders overlap the caption requests of the
+    projects still waiting on OpenAI. At most max_in_flight chunks sit on the
+    pool over all projects, and at most the project quota per project, with
+    the free slots going to the project with the fewest chunks in flight.
+
+    Parameters:
+    - projects (List[str]): The projects to run.
+    - caption_workers (int): Projects generating captions at the same time. Default is 4.
+    - render_workers (int, optional): Worker processes shared by every project. Defaults to the CPU count.
+    - max_in_flight (int, optional): Chunks on the pool over all projects. Defaults to twice the render workers.
+    - project_quota (int, optional): Chunks on the pool per project. Defaults to the scheduler.project_quota of the project config, then to max_in_flight.
+    - chunksize (int): Number of images sent to a worker at a time. Default is 4.
+    - refresh (bool): Ask OpenAI again instead of reusing cached captions.
+    - force (bool): Render every pin again, starting new manifests.
+
+    Returns:
+    - Dict[str, pd.DataFrame]: The render report of each project, None for projects that failed before rendering.
+    """
+    render_workers = render_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * render_workers
+    runs = {}
+    for project in projects:
+        quota = project_quota or (get_config(project).get("scheduler") or {}).get(
+            "project_quota"
+        )
+        runs[project] = ProjectRun(project, quota or max_in_flight, force=force)
+    reports = {}
+
+    with ThreadPoolExecutor(
+        max_workers=caption_workers, thread_name_prefix="captions"
+    ) as caption_pool, ProcessPoolExecutor(
+        max_workers=render_workers,
+        initializer=init_scheduler_worker,
+        initargs=(projects,),
+    ) as render_pool:
+        caption_jobs: Dict[Future, ProjectRun] = {
+            caption_pool.submit(generate_captions, project, refresh): run
+            for project, run in runs.items()
+        }
+        render_jobs: Dict[Future, tuple] = {}
+
+        def fill_slots() -> None:
+            while len(render_jobs) < max_in_flight:
+                ready = [run for run in runs.values() if run.ready]
+                if not ready:
+                    return
+                run = min(ready, key=lambda r: r.in_flight)
+                chunk = run.queue.popleft()
+                run.in_flight += 1
+                render_jobs[render_pool.submit(render_chunk, chunk)] = (run, chunk)
+
+        pending = set(caption_jobs)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in caption_jobs:
+                    run = caption_jobs.pop(future)
+                    try:
+                        run.plan(future.result(), chunksize)
+                    except Exception as e:
+                        run.error = f"{type(e).__name__}: {e}"
+                else:
+                    run, chunk = render_jobs.pop(future)
+                    try:
+                        chunk_results = future.result()
+                    except Exception as e:
+                        # A crashed worker, the rest of the chunk fails with it
+                        chunk_results = [
+                            {
+                                "idx": task["idx"],
+                                "images": None,
+                                "error": f"{type(e).__name__}: {e}",
+                            }
+                            for task in chunk
+                        ]
+                    run.record(chunk, chunk_results)
+                if run.done and run.project not in reports:
+                    reports[run.project] = run.finish()
+            fill_slots()
+            pending |= set(render_jobs)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate and render the pins of several projects at once."
+    )
+    parser.add_argument(
+        "projects",
+        nargs="*",
+        help="Projects to run. Defaults to scheduler.projects, then to every project under src/config",
+    )
+    parser.add_argument(
+        "--caption-workers", type=int, default=None, help="Projects captioned at once"
+    )
+    parser.add_argument(
+        "--render-workers", type=int, default=None, help="Shared worker processes"
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=None,
+        help="Render chunks queued over all projects",
+    )
+    parser.add_argument(
+        "--quota", type=int, default=None, help="Render chunks queued per project"
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=None, help="Images per worker task"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ask OpenAI again instead of reusing cached captions",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render every pin again, starting new manifests",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Time each stage and write a Chrome trace to tracing.path",
+    )
+    args = parser.parse_args()
+
+    params = get_config()
+    scheduler_params = params.get("scheduler") or {}
+    projects = args.projects or scheduler_params.get("projects") or discover_projects()
+    unknown = set(projects) - set(discover_projects())
+    if unknown:
+        parser.error(f"Unknown projects: {', '.join(sorted(unknown))}")
+    trace_path = start_tracing(params, force=args.trace)
+
+    start = time.time()
+    reports = schedule_projects(
+        projects,
+        caption_workers=args.caption_workers
+        or scheduler_params.get("caption_workers", 4),
+        render_workers=args.render_workers or scheduler_params.get("render_workers"),
+        max_in_flight=args.max_in_flight or scheduler_params.get("max_in_flight"),
+        project_quota=args.quota,
+        chunksize=args.chunksize or params.get("render", {}).get("chunksize", 4),
+        refresh=args.refresh,
+        force=args.force,
+    )
+    failed = [project for project, report in reports.items() if report is None]
+    print(
+        f"Scheduled {len(reports)} projects in {time.time() - start:.1f} seconds"
+        + (f", failed for {', '.join(failed)}" if failed else "")
+    )
+    finish_tracing(trace_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The modules under src import each other as top level packages, like the scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def font_path():
+    from benchmarks.fixtures import find_font
+
+    try:
+        return find_font()
+    except FileNotFoundError:
+        pytest.skip("No font in src/fonts or the system fonts")
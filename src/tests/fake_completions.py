@@ -0,0 +1,100 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+
+class FakeCompletionServer:
+    """
+    Local stand-in for the OpenAI chat completions endpoint.
+
+    Answers POST .../chat/completions with as many numbered captions as the
+    prompt asks for ("a list of {n}"). Every request is recorded with its
+    arrival time. Queued failures are answered first, one per request, as a
+    (status, headers) pair, e.g. (429, {"Retry-After": "1"}). delays are
+    seconds to wait before answering, the k-th entry for the k-th request.
+    """
+
+    def __init__(self, delays: Optional[List[float]] = None):
+        self.delays = list(delays or [])
+        self.failures: List[tuple] = []
+        self.requests: List[dict] = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def __enter__(self) -> "FakeCompletionServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send_json(self, status: int, payload: dict, headers=None) -> None:
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                with fake._lock:
+                    number = len(fake.requests)
+                    fake.requests.append({"time": time.monotonic(), "payload": payload})
+                    failure = fake.failures.pop(0) if fake.failures else None
+                    delay = fake.delays[number] if number < len(fake.delays) else 0
+                if failure:
+                    status, headers = failure
+                    self._send_json(
+                        status,
+                        {"error": {"message": "fake failure", "type": "fake"}},
+                        headers,
+                    )
+                    return
+                time.sleep(delay)
+                prompt = payload["messages"][-1]["content"]
+                n = int(re.search(r"a list of (\d+)", prompt).group(1))
+                content = "\n".join(f"{i + 1}. Caption {number}-{i}" for i in range(n))
+                self._send_json(
+                    200,
+                    {
+                        "id": f"fake-{number}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": payload["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": {
+                            "prompt_tokens": 0,
+                            "completion_tokens": 0,
+                            "total_tokens": 0,
+                        },
+                    },
+                )
+
+        return Handler
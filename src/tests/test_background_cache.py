@@ -0,0 +1,44 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from processing.image_processing import BackgroundCache, background_cache
+
+
+def _attach_and_detach(descriptors, path):
+    background_cache.attach(descriptors)
+    shared = np.asarray(background_cache.get(path)).copy()
+    background_cache.detach()
+    # Once detached the worker decodes the file itself
+    decoded = np.asarray(background_cache.get(path)).copy()
+    return shared, decoded
+
+
+def test_workers_detach_and_the_parent_unlinks(tmp_path):
+    path = str(tmp_path / "background.png")
+    Image.fromarray(
+        np.random.default_rng(0).integers(0, 256, (30, 20, 3), dtype=np.uint8)
+    ).save(path)
+    parent = BackgroundCache()
+    descriptors = parent.publish([path])
+    names = [name for name, _ in descriptors.values()]
+    try:
+        # The worker process exits when the pool shuts down, running its finalizers
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            shared, decoded = pool.submit(
+                _attach_and_detach, descriptors, path
+            ).result()
+        expected = np.asarray(parent.get(path))
+        np.testing.assert_array_equal(shared, expected)
+        np.testing.assert_array_equal(decoded, expected)
+        # The parent still owns the segments until release
+        shared_memory.SharedMemory(name=names[0]).close()
+    finally:
+        parent.release()
+
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
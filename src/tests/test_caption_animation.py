@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from benchmarks.fixtures import make_backgrounds, make_params
+from creation_infographic import create_animated_caption, create_captioned_image
+
+CAPTION = "Wander far and travel light, keep the sunset close"
+
+
+@pytest.mark.parametrize("align", ["left", "center", "right"])
+def test_animated_caption_ends_on_the_still_pin(tmp_path, font_path, align):
+    params = make_params(str(tmp_path), font_path)
+    params["font"]["text_coords"]["align"] = align
+    (background,) = make_backgrounds(str(tmp_path / "background"), n=1, size=(400, 600))
+    kwargs = dict(
+        caption=CAPTION,
+        font_path=font_path,
+        img_path=background,
+        text_color=params["font"]["text_color"],
+        font_size=36,
+        wrap_block=20,
+        params=params,
+    )
+
+    still = create_captioned_image(save_to=None, **kwargs)
+    animated = create_animated_caption(**kwargs)
+
+    frames = [frame.copy() for frame in animated.frames(10)]
+    assert len(frames) == 10
+    # Typing on: the first frame shows less text than the last
+    assert np.abs(frames[0].astype(int) - frames[-1]).sum() > 0
+
+    final = np.asarray(animated.final_image()).astype(int)
+    expected = np.asarray(still.convert("RGB")).astype(int)
+    assert np.abs(final - expected).max() <= 1
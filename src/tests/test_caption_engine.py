@@ -0,0 +1,136 @@
+import asyncio
+import functools
+import time
+
+import pytest
+
+import creation_caption
+from creation_caption import (
+    TokenBucket,
+    create_caption_async,
+    create_caption_bulk_concurrent,
+)
+from fake_completions import FakeCompletionServer
+
+PROMPT = "Provide me a list of {n} travel quotes."
+
+
+@pytest.fixture(autouse=True)
+def fake_api_key(monkeypatch):
+    monkeypatch.setattr(creation_caption, "api_key", "sk-fake")
+
+
+def test_chunks_are_returned_in_order():
+    # Earlier requests answer later, so the chunks complete out of order
+    with FakeCompletionServer(delays=[0.4, 0.3, 0.2, 0.1]) as server:
+        arrived = []
+        data = create_caption_bulk_concurrent(
+            PROMPT,
+            10,
+            chunk_size=3,
+            concurrency=4,
+            rpm=None,
+            api_base=server.api_base,
+            on_captions=lambda idx, captions: arrived.append((idx, captions)),
+        )
+
+    assert [idx for idx, _ in arrived] != sorted(idx for idx, _ in arrived)
+    assert [len(captions) for _, captions in sorted(arrived)] == [3, 3, 3, 1]
+    assert list(data["chunk"]) == [0, 0, 0, 1, 1, 1, 2, 2, 2, 3]
+    assert list(data["caption"]) == [
+        caption for _, captions in sorted(arrived) for caption in captions
+    ]
+    prompts = [r["payload"]["messages"][-1]["content"] for r in server.requests]
+    assert sorted(prompts) == sorted(
+        [PROMPT.replace("{n}", "3")] * 3 + [PROMPT.replace("{n}", "1")]
+    )
+
+
+def test_retries_after_429_with_retry_after():
+    with FakeCompletionServer() as server:
+        server.failures.append((429, {"Retry-After": "1"}))
+        caption = asyncio.run(
+            create_caption_async(
+                PROMPT.replace("{n}", "1"),
+                api_base=server.api_base,
+                backoff=0.01,
+                max_retries=2,
+            )
+        )
+
+    assert caption == "Caption 1-0"
+    first, retry = server.requests
+    # The jittered backoff is at most 10 ms, the wait comes from Retry-After
+    assert retry["time"] - first["time"] >= 1.0
+
+
+def test_backoff_jitter_bounds(monkeypatch):
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append((low, high))
+        return high
+
+    monkeypatch.setattr(creation_caption.random, "uniform", uniform)
+    with FakeCompletionServer() as server:
+        server.failures.extend([(500, {})] * 3)
+        asyncio.run(
+            create_caption_async(
+                PROMPT.replace("{n}", "1"),
+                api_base=server.api_base,
+                backoff=0.02,
+                max_backoff=0.05,
+                max_retries=3,
+            )
+        )
+
+    # Full jitter between 0 and the doubled backoff, capped at max_backoff
+    assert bounds == [(0, 0.02), (0, 0.04), (0, 0.05)]
+    gaps = [b["time"] - a["time"] for a, b in zip(server.requests, server.requests[1:])]
+    assert all(gap >= high for gap, (_, high) in zip(gaps, bounds))
+
+
+def test_retries_give_up_after_max_retries():
+    with FakeCompletionServer() as server:
+        server.failures.extend([(429, {})] * 3)
+        with pytest.raises(creation_caption.openai.error.RateLimitError):
+            asyncio.run(
+                create_caption_async(
+                    PROMPT.replace("{n}", "1"),
+                    api_base=server.api_base,
+                    backoff=0.01,
+                    max_retries=2,
+                )
+            )
+    assert len(server.requests) == 3
+
+
+def test_token_bucket_limits_the_rate():
+    async def acquire_all(bucket, n):
+        times = []
+        for _ in range(n):
+            await bucket.acquire()
+            times.append(time.monotonic())
+        return times
+
+    # 600 per minute is one every 100 ms, after a burst of 2
+    times = asyncio.run(acquire_all(TokenBucket(600, capacity=2), 6))
+    assert times[1] - times[0] < 0.05
+    assert times[-1] - times[0] >= 0.38
+
+
+def test_requests_per_minute_is_honored(monkeypatch):
+    # Without a burst the requests are spaced by the rate from the start
+    monkeypatch.setattr(
+        creation_caption, "TokenBucket", functools.partial(TokenBucket, capacity=1)
+    )
+    with FakeCompletionServer() as server:
+        create_caption_bulk_concurrent(
+            PROMPT, 5, chunk_size=1, concurrency=5, rpm=600, api_base=server.api_base
+        )
+
+    times = sorted(r["time"] for r in server.requests)
+    assert len(times) == 5
+    # One request every 100 ms, with some slack for the clock and the loop
+    assert all(b - a >= 0.08 for a, b in zip(times, times[1:]))
+    assert times[-1] - times[0] >= 0.38
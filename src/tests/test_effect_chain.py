@@ -0,0 +1,87 @@
+import itertools
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from processing.image_processing import (
+    apply_effect_chain,
+    get_image_effect_dict,
+    image_effects,
+)
+
+OVERLAYS = [("#0000", 0.1), ("#000000", 0.5), ("#FF8800", 0.35), ("#12345680", 1.0)]
+PORTRAITS = ["#FFFFFF", "#C03020"]
+
+
+def synthetic_backgrounds():
+    """A gradient and noise in the modes backgrounds come in."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, 64, dtype=np.uint8)
+    gradient = np.stack(np.broadcast_arrays(x[None, :], x[:, None], x[::-1, None]), -1)
+    noise = rng.integers(0, 256, (48, 80, 4), dtype=np.uint8)
+    rgb = Image.fromarray(np.ascontiguousarray(gradient), "RGB")
+    return {
+        "rgb": rgb,
+        "rgba": Image.fromarray(noise, "RGBA"),
+        "opaque_rgba": rgb.convert("RGBA"),
+        "l": Image.fromarray(noise[..., 0], "L"),
+        "p": rgb.convert("P"),
+    }
+
+
+def effect_params(color_overlay: str, alpha: float, color_portrait: str) -> dict:
+    return {
+        "image_processing": {
+            "color_overlay": color_overlay,
+            "alpha_overlay": alpha,
+            "color_portrait": color_portrait,
+        }
+    }
+
+
+def chains():
+    """Every effect alone, and every order of two and three effects."""
+    names = list(get_image_effect_dict(effect_params("#0000", 0.5, "#FFFFFF")))
+    for length in range(1, len(names) + 1):
+        yield from itertools.permutations(names, length)
+
+
+@pytest.mark.parametrize("mode", list(synthetic_backgrounds()))
+@pytest.mark.parametrize("color_overlay,alpha", OVERLAYS)
+@pytest.mark.parametrize("color_portrait", PORTRAITS)
+def test_effect_chain_matches_image_effects(mode, color_overlay, alpha, color_portrait):
+    params = effect_params(color_overlay, alpha, color_portrait)
+    effect_dict = get_image_effect_dict(params)
+    background = synthetic_backgrounds()[mode]
+
+    for effects in chains():
+        expected = background.copy()
+        try:
+            for effect in effects:
+                expected = image_effects(expected, effect, effect_dict)
+        except ValueError:
+            # e.g. blurring a palette image, the chain must fail the same way
+            with pytest.raises(ValueError):
+                apply_effect_chain(background.copy(), list(effects), params=params)
+            continue
+        result = apply_effect_chain(background.copy(), list(effects), params=params)
+
+        assert result.mode == expected.mode, effects
+        assert result.size == expected.size, effects
+        # overlay_lut is tabulated with Image.blend, so no rounding difference is expected
+        np.testing.assert_array_equal(
+            np.asarray(result), np.asarray(expected), err_msg=str(effects)
+        )
+
+
+def test_effect_chain_reads_the_configured_effects():
+    params = effect_params("#FF8800", 0.35, "#C03020")
+    params["image_processing"]["effects"] = ["overlay", "portrait"]
+    background = synthetic_backgrounds()["rgb"]
+    expected = image_effects(
+        background.copy(), "overlay", get_image_effect_dict(params)
+    )
+    expected = image_effects(expected, "portrait", get_image_effect_dict(params))
+    result = apply_effect_chain(background.copy(), params=params)
+    np.testing.assert_array_equal(np.asarray(result), np.asarray(expected))
@@ -0,0 +1,26 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from processing.video_processing import iter_frames
+
+
+@pytest.mark.parametrize(
+    "size,frame_size",
+    [((300, 450), (400, 400)), ((500, 200), (320, 480)), ((90, 60), (180, 120))],
+)
+def test_arrays_are_letterboxed_like_images(size, frame_size):
+    y, x = np.mgrid[0 : size[1], 0 : size[0]]
+    rgb = np.stack(
+        [x * 255 // size[0], y * 255 // size[1], (x + y) * 255 // sum(size)], -1
+    ).astype(np.uint8)
+    bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+    from_image, from_array = iter_frames([Image.fromarray(rgb), bgr], frame_size)
+
+    assert from_array.shape == from_image.shape == (frame_size[1], frame_size[0], 3)
+    # Same letterbox, only the resampling filters differ
+    borders = (from_image == 0).all(axis=-1)
+    np.testing.assert_array_equal((from_array == 0).all(axis=-1) & borders, borders)
+    assert np.abs(from_array.astype(int) - from_image).mean() < 2
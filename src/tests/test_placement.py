@@ -0,0 +1,62 @@
+import numpy as np
+from PIL import Image
+
+from benchmarks.fixtures import make_backgrounds, make_params
+from creation_infographic import create_captioned_image
+from processing.placement import apply_local_overlay
+
+BOX = (10, 20, 40, 50)
+FILL = (0, 0, 0, 128)
+
+
+def test_local_overlay_blends_over_rgba():
+    image = Image.new("RGBA", (64, 80), (128, 128, 128, 229))
+    result = np.asarray(apply_local_overlay(image, (BOX, FILL))).astype(int)
+    original = np.asarray(image).astype(int)
+
+    inside = np.zeros(result.shape[:2], dtype=bool)
+    inside[BOX[1] : BOX[3] + 1, BOX[0] : BOX[2] + 1] = True
+    np.testing.assert_array_equal(result[~inside], original[~inside])
+
+    # Source over, not a copy of the fill
+    out_alpha = 128 + 229 * (1 - 128 / 255)
+    out_grey = 128 * 229 * (1 - 128 / 255) / out_alpha
+    np.testing.assert_allclose(
+        result[30, 20], [out_grey, out_grey, out_grey, out_alpha], atol=1
+    )
+
+
+def test_local_overlay_blends_over_rgb():
+    image = Image.new("RGB", (64, 80), (200, 100, 50))
+    result = np.asarray(apply_local_overlay(image, (BOX, FILL))).astype(int)
+    np.testing.assert_array_equal(result[0, 0], [200, 100, 50])
+    np.testing.assert_allclose(result[30, 20], [100, 50, 25], atol=1)
+
+
+def test_contrast_overlay_keeps_the_pin_alpha(tmp_path, font_path):
+    params = make_params(str(tmp_path), font_path)
+    (background,) = make_backgrounds(str(tmp_path / "background"), n=1, size=(300, 400))
+
+    def render(contrast: dict) -> np.ndarray:
+        params["font"]["contrast"] = contrast
+        image = create_captioned_image(
+            caption="Travel far",
+            img_path=background,
+            save_to=None,
+            font_path=font_path,
+            text_color=params["font"]["text_color"],
+            font_size=40,
+            params=params,
+        )
+        return np.asarray(image.convert("RGBA")).astype(int)
+
+    plain = render({"enabled": False})
+    # No position reaches 21:1, so a local overlay is always added
+    placed = render({"enabled": True, "min_contrast": 21, "overlay_alpha_max": 0.6})
+
+    # The effect overlay leaves alpha at 229, the text box may only add to it
+    assert plain[..., 3].min() == 229
+    assert placed[..., 3].min() == 229
+    changed = (placed[..., :3] != plain[..., :3]).any(axis=-1)
+    assert changed.any()
+    assert (placed[..., 3][changed] >= 229).all()
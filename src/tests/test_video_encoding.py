@@ -0,0 +1,81 @@
+import re
+import subprocess
+
+import numpy as np
+import pytest
+
+from processing.encoders import find_ffmpeg
+from processing.video_processing import create_video_from_images
+
+FFMPEG = find_ffmpeg()
+pytestmark = pytest.mark.skipif(FFMPEG is None, reason="ffmpeg not found")
+
+
+def probe(path: str) -> dict:
+    """Duration, frame rate and decoded frame count of a video."""
+    output = subprocess.run(
+        [FFMPEG, "-i", path, "-map", "0:v:0", "-f", "null", "-"],
+        capture_output=True,
+        text=True,
+    ).stderr
+    hours, minutes, seconds = re.search(
+        r"Duration: (\d+):(\d+):([\d.]+)", output
+    ).groups()
+    return {
+        "duration": int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        "fps": float(re.search(r"([\d.]+) fps", output).group(1)),
+        "frames": int(re.findall(r"frame=\s*(\d+)", output)[-1]),
+        "audio": "Audio:" in output,
+    }
+
+
+def stills(n: int) -> list:
+    return [np.full((120, 160, 3), 25 * i, dtype=np.uint8) for i in range(n)]
+
+
+@pytest.mark.parametrize("audio", [False, True])
+def test_static_slideshow_keeps_the_frame_rate(tmp_path, audio):
+    encoder = {}
+    if audio:
+        tone = str(tmp_path / "tone.m4a")
+        subprocess.run(
+            [FFMPEG, "-y", "-loglevel", "error", "-f", "lavfi"]
+            + ["-i", "sine=frequency=440:duration=3", tone],
+            check=True,
+        )
+        encoder["audio"] = tone
+    create_video_from_images(
+        stills(9),
+        "slideshow.mp4",
+        str(tmp_path),
+        duration=9,
+        frame_rate=30,
+        params={"video_processing": {}},
+        encoder=encoder,
+        transitions={},
+    )
+
+    info = probe(str(tmp_path / "slideshow.mp4"))
+    # 9 stills of 30 frames each, repeated by ffmpeg at the configured rate
+    assert info["fps"] == 30
+    assert info["frames"] == 270
+    assert abs(info["duration"] - 9) <= 0.1
+    assert info["audio"] == audio
+
+
+def test_segment_rate_keeps_one_frame_per_still(tmp_path):
+    create_video_from_images(
+        stills(4),
+        "slideshow.mp4",
+        str(tmp_path),
+        duration=8,
+        frame_rate=30,
+        params={"video_processing": {}},
+        encoder={"static_segments": "segment_rate"},
+        transitions={},
+    )
+
+    info = probe(str(tmp_path / "slideshow.mp4"))
+    assert info["frames"] == 4
+    assert info["fps"] == 0.5
+    assert abs(info["duration"] - 8) <= 0.1